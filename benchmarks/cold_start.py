@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+import tempfile
+import statistics
+import subprocess
+from time import perf_counter
+
+
+"""
+Cold start benchmark. Spawns fresh interpreters, which import mqe or run a tiny executable,
+and reports the wall time per process. The cases are interleaved (one run of each case per round),
+so a slow period of the machine affects all of them alike.
+"""
+
+
+# "1.1 " header, no includes, one instruction: HALT
+HALT_EXECUTABLE = b"1.1 " + (0).to_bytes(2, "little") + (2).to_bytes(4, "little") + (127).to_bytes(2, "little")
+
+
+def measure(commands: dict[str, list[str]], runs: int) -> dict[str, list[float]]:
+    """
+    Runs the commands in rounds, each command once per round
+    :param commands: commands by name
+    :param runs: amount of runs per command
+    :return: wall times in seconds by name
+    """
+
+    times = {name: [] for name in commands}
+    for _ in range(runs):
+        for name, command in commands.items():
+            start = perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            times[name].append(perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures mqe cold start time")
+    parser.add_argument("-n", "--runs", type=int, default=20, help="amount of runs per case")
+    args = parser.parse_args()
+
+    # run from the source tree, if mqe isn't installed
+    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [env_path, os.environ.get("PYTHONPATH")]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        executable = os.path.join(directory, "halt.mqa")
+        with open(executable, "wb") as file:
+            file.write(HALT_EXECUTABLE)
+
+        cases = {
+            "python (baseline)": [sys.executable, "-c", "pass"],
+            "import mqe": [sys.executable, "-c", "import mqe"],
+            "mqe halt.mqa": [sys.executable, "-m", "mqe", executable],
+        }
+        for name, times in measure(cases, args.runs).items():
+            print(f"{name: <20} median {statistics.median(times) * 1000:8.2f} ms   min {min(times) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,27 @@
 from ._emulator import Emulator
+from ._pool import EmulatorPool
+from ._executable import Executable
+from ._pacing import Pacer
 from ._main import main
-from .ext import *
+
+
+# imported on first access, as these pull in tkinter, multiprocessing, sockets, threading, json and re,
+# or are only used by some commands
+_LAZY_ATTRIBUTES: dict[str, str] = {
+    "ControlFlowGraph": "mqe._analysis:ControlFlowGraph",
+    "Metrics": "mqe._metrics:Metrics",
+    "TraceWriter": "mqe._trace:TraceWriter",
+    "TraceReader": "mqe._trace:TraceReader",
+    "System": "mqe._system:System",
+    "JobServer": "mqe._server:JobServer",
+    "Client": "mqe._server:Client",
+    "FileManager": "mqe.ext._file_system:FileManager",
+    "DisplayManager": "mqe.ext._display:DisplayManager",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        from .ext import load_extension
+        return load_extension(_LAZY_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,546 @@
+from ._mqis import *
+
+
+"""
+Static control flow analysis of MQ programs.
+
+Jump and call targets are (rom_page << 8) + operand, so they are resolved by tracking the
+ROM page register through the program. The page is known after 'CRP n', and unknown after
+'CRP $n' (value from cache). Jumps with a memory flag, or with an unknown page, are unresolved.
+Calls are assumed to preserve the ROM page, unless the called function contains a CRP.
+"""
+
+
+# opcodes
+CALL = 3
+RET = 4
+JMP = 5
+CONDITIONAL_JUMPS = (6, 7, 8, 9)    # JMPP, JMPZ, JMPN, JMPC
+CRP = 13
+INT = 126
+HALT = 127
+
+
+class Instruction:
+    """
+    Decoded instruction
+    """
+
+    __slots__ = ("pc", "opcode", "data", "memory_flag")
+
+    def __init__(self, pc: int, opcode: int, data: int, memory_flag: int):
+        self.pc: int = pc
+        self.opcode: int = opcode
+        self.data: int = data
+        self.memory_flag: int = memory_flag
+
+    @property
+    def is_valid(self) -> bool:
+        return self.opcode in InstructionSet.instruction_set
+
+    @property
+    def name(self) -> str:
+        return InstructionSet.instruction_set.get(self.opcode, {"name": "???"})["name"]
+
+    @property
+    def ticks(self) -> int:
+        if not self.is_valid:
+            return 0
+        return InstructionSet.instruction_set[self.opcode]["cache" if self.memory_flag else "ROM"]
+
+    def __str__(self):
+        return f"{self.name: <4} {'$' if self.memory_flag else ''}{self.data}"
+
+
+class BasicBlock:
+    """
+    Straight line sequence of instructions, which is entered at the start and left at the end
+    """
+
+    def __init__(self, start: int):
+        self.start: int = start
+        self.instructions: list[Instruction] = []
+        self.successors: list[int] = []         # block starts within the same function
+        self.calls: list[int] = []              # called function entries
+        self.unresolved: bool = False           # has a jump or call with an unknown target
+
+    @property
+    def end(self) -> int:
+        """
+        :return: pc after the last instruction
+        """
+
+        return self.start + len(self.instructions)
+
+    @property
+    def ticks(self) -> int:
+        return sum(instruction.ticks for instruction in self.instructions)
+
+    def __repr__(self):
+        return f"<BasicBlock {self.start}..{self.end - 1}>"
+
+
+class Loop:
+    """
+    Natural loop
+    """
+
+    def __init__(self, header: int, function: int):
+        self.header: int = header
+        self.function: int = function
+        self.blocks: set[int] = {header}
+        self.back_edges: set[int] = set()       # blocks jumping back to the header
+        self.depth: int = 1
+        self.iteration_ticks: int | None = None   # worst case ticks of one iteration
+
+    def __repr__(self):
+        return f"<Loop {self.header}>"
+
+
+class Function:
+    """
+    Code reachable from a call target (or the program entry) without following calls
+    """
+
+    def __init__(self, entry: int):
+        self.entry: int = entry
+        self.blocks: set[int] = set()
+        self.calls: set[int] = set()
+        self.loops: list[Loop] = []
+        self.changes_page: bool = False
+        self.unresolved: bool = False
+        self.worst_ticks: int | None = None     # worst case ticks of one call (None if unbounded)
+
+    def __repr__(self):
+        return f"<Function {self.entry}>"
+
+
+class ControlFlowGraph:
+    """
+    Control flow graph of a program. Can be used as an index by other engines:
+    block_at(pc) gives the basic block containing the pc.
+    """
+
+    def __init__(self, rom: bytes):
+        """
+        Builds the control flow graph
+        :param rom: ROM contents (2 bytes per instruction)
+        """
+
+        self.instructions: list[Instruction] = [
+            Instruction(idx // 2, rom[idx] & 127, (((rom[idx + 1] << 8) + rom[idx]) >> 7) & 255, rom[idx + 1] >> 7)
+            for idx in range(0, len(rom) - 1, 2)
+        ]
+        self.blocks: dict[int, BasicBlock] = {}
+        self.functions: dict[int, Function] = {}
+        self.loops: list[Loop] = []
+        self.unresolved: list[int] = []         # pcs of jumps and calls with unknown targets
+
+        self._block_index: dict[int, int] = {}
+
+        # page changing functions are only known after the functions were found, so repeat until it settles;
+        # the set only grows, as a function can lose its page change once its callers lose their page
+        changing = set()
+        while True:
+            pages = self._propagate_pages(changing)
+            self._build_blocks(pages, changing)
+            self._build_functions()
+            new_changing = changing | {entry for entry, function in self.functions.items() if function.changes_page}
+            if new_changing == changing:
+                break
+            changing = new_changing
+
+        self._find_loops()
+        self._compute_costs()
+
+    def block_at(self, pc: int) -> BasicBlock | None:
+        """
+        :param pc: program counter
+        :return: basic block containing the pc, or None if the pc is unreachable
+        """
+
+        start = self._block_index.get(pc)
+        return self.blocks[start] if start is not None else None
+
+    def _targets(self, instruction: Instruction, page: int | None) -> int | None:
+        """
+        :return: jump target, or None if it can't be resolved
+        """
+
+        if instruction.memory_flag or page is None:
+            return None
+        return (page << 8) + instruction.data
+
+    def _edges(self, instruction: Instruction, page: int | None, changing: set[int]):
+        """
+        Control flow edges of an instruction
+        :return: list of (pc, page) states and list of called pcs (None for unresolved)
+        """
+
+        opcode = instruction.opcode
+        following = instruction.pc + 1
+        if not instruction.is_valid or opcode in (RET, HALT):
+            return [], []
+        if opcode == CRP:
+            return [(following, None if instruction.memory_flag else instruction.data)], []
+        if opcode == JMP:
+            target = self._targets(instruction, page)
+            return ([(target, page)] if target is not None else []), ([None] if target is None else [])
+        if opcode in CONDITIONAL_JUMPS:
+            target = self._targets(instruction, page)
+            states = [(following, page)]
+            if target is not None:
+                states.append((target, page))
+            return states, ([None] if target is None else [])
+        if opcode == CALL:
+            target = self._targets(instruction, page)
+            if target is None:
+                return [(following, None)], [None]
+            return [(following, None if target in changing else page)], [target]
+        return [(following, page)], []
+
+    def _propagate_pages(self, changing: set[int]) -> dict[int, set[int | None]]:
+        """
+        Finds the reachable instructions, and the possible ROM page values at each of them
+        """
+
+        count = len(self.instructions)
+        pages: dict[int, set[int | None]] = {}
+        worklist = [(0, 0)]
+        while worklist:
+            pc, page = worklist.pop()
+            if pc >= count or page in pages.setdefault(pc, set()):
+                continue
+            pages[pc].add(page)
+
+            states, calls = self._edges(self.instructions[pc], page, changing)
+            worklist.extend(states)
+            worklist.extend((target, page) for target in calls if target is not None)
+        return {pc: page_set for pc, page_set in pages.items() if pc < count}
+
+    def _build_blocks(self, pages: dict[int, set[int | None]], changing: set[int]):
+        """
+        Splits the reachable instructions into basic blocks
+        """
+
+        # edges of each instruction
+        edges = {}
+        calls = {}
+        self.unresolved = []
+        for pc, page_set in pages.items():
+            edges[pc] = set()
+            calls[pc] = set()
+            for page in page_set:
+                states, called = self._edges(self.instructions[pc], page, changing)
+                edges[pc].update(state_pc for state_pc, _ in states if state_pc in pages)
+                calls[pc].update(called)
+            if None in calls[pc]:
+                self.unresolved.append(pc)
+                calls[pc].discard(None)
+            calls[pc] = {target for target in calls[pc] if target in pages}
+        self.unresolved.sort()
+
+        # block leaders; entry, targets of jumps, instructions after control flow changes
+        leaders = {0} | {target for called in calls.values() for target in called}
+        for pc, successors in edges.items():
+            if successors != {pc + 1} or calls[pc] or pc in self.unresolved:
+                leaders.update(successors)
+                leaders.add(pc + 1)
+
+        # make the blocks
+        self.blocks = {}
+        self._block_index = {}
+        for leader in sorted(leader for leader in leaders if leader in pages):
+            block = BasicBlock(leader)
+            pc = leader
+            while True:
+                block.instructions.append(self.instructions[pc])
+                self._block_index[pc] = leader
+                if edges[pc] != {pc + 1} or calls[pc] or pc in self.unresolved or pc + 1 in leaders:
+                    break
+                pc += 1
+            block.successors = sorted(edges[pc])
+            block.calls = sorted(calls[pc])
+            block.unresolved = pc in self.unresolved
+            self.blocks[leader] = block
+
+    def _build_functions(self):
+        """
+        Finds the functions, their blocks and call graph
+        """
+
+        # the entry point only exists if the ROM isn't empty
+        entries = {target for block in self.blocks.values() for target in block.calls}
+        if 0 in self.blocks:
+            entries.add(0)
+        self.functions = {}
+        for entry in sorted(entries):
+            function = Function(entry)
+            worklist = [entry]
+            while worklist:
+                start = worklist.pop()
+                if start in function.blocks:
+                    continue
+                function.blocks.add(start)
+                block = self.blocks[start]
+                function.calls.update(block.calls)
+                function.unresolved |= block.unresolved
+                function.changes_page |= any(instruction.opcode == CRP for instruction in block.instructions)
+                worklist.extend(block.successors)
+            self.functions[entry] = function
+
+        # functions calling page changing functions also change the page
+        changed = True
+        while changed:
+            changed = False
+            for function in self.functions.values():
+                if not function.changes_page and any(self.functions[callee].changes_page for callee in function.calls):
+                    function.changes_page = True
+                    changed = True
+
+    def _find_loops(self):
+        """
+        Finds the natural loops of each function
+        """
+
+        self.loops = []
+        for function in self.functions.values():
+            predecessors = self._predecessors(function)
+            dominator_tree = self._dominator_tree(function, predecessors)
+            loops: dict[int, Loop] = {}
+            for start in function.blocks:
+                for successor in self.blocks[start].successors:
+                    # back edge; the successor dominates the block
+                    enter, leave = dominator_tree[successor]
+                    if enter <= dominator_tree[start][0] and dominator_tree[start][1] <= leave:
+                        loop = loops.setdefault(successor, Loop(successor, function.entry))
+                        loop.back_edges.add(start)
+
+            # loop bodies; blocks reaching the back edge without passing through the header
+            for loop in loops.values():
+                worklist = list(loop.back_edges)
+                while worklist:
+                    start = worklist.pop()
+                    if start in loop.blocks:
+                        continue
+                    loop.blocks.add(start)
+                    worklist.extend(predecessors[start])
+
+            # nesting depth
+            for loop in loops.values():
+                loop.depth = sum(1 for other in loops.values() if loop.header in other.blocks)
+
+            function.loops = sorted(loops.values(), key=lambda x: x.header)
+            self.loops.extend(function.loops)
+
+    def _predecessors(self, function: Function) -> dict[int, set[int]]:
+        predecessors = {start: set() for start in function.blocks}
+        for start in function.blocks:
+            for successor in self.blocks[start].successors:
+                predecessors[successor].add(start)
+        return predecessors
+
+    def _postorder(self, entry: int) -> list[int]:
+        """
+        :return: blocks reachable from the entry block (without following calls) in depth first postorder
+        """
+
+        order = []
+        visited = {entry}
+        stack = [(entry, iter(self.blocks[entry].successors))]
+        while stack:
+            start, remaining = stack[-1]
+            for successor in remaining:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(start)
+        return order
+
+    def _dominator_tree(self, function: Function, predecessors: dict[int, set[int]]) -> dict[int, tuple[int, int]]:
+        """
+        Finds the immediate dominators (Cooper, Harvey and Kennedy: "A Simple, Fast Dominance Algorithm"),
+        and numbers the dominator tree, so that a block dominates another one if its interval contains the other's
+        :return: (enter, leave) interval of each block
+        """
+
+        # immediate dominators, by postorder numbers; blocks are processed in reverse postorder until nothing changes
+        order = self._postorder(function.entry)
+        number = {start: index for index, start in enumerate(order)}
+        entry = len(order) - 1
+        pred_numbers = [[number[pred] for pred in predecessors[start]] for start in order]
+        idom = [-1] * len(order)
+        idom[entry] = entry
+        changed = True
+        while changed:
+            changed = False
+            for block in range(entry - 1, -1, -1):
+                new = -1
+                for pred in pred_numbers[block]:
+                    if idom[pred] == -1:
+                        continue
+                    if new == -1:
+                        new = pred
+                        continue
+
+                    # closest common dominator; the dominators have higher postorder numbers
+                    while new != pred:
+                        while new < pred:
+                            new = idom[new]
+                        while pred < new:
+                            pred = idom[pred]
+                if idom[block] != new:
+                    idom[block] = new
+                    changed = True
+
+        # number the dominator tree
+        children = {start: [] for start in order}
+        for block in range(entry):
+            children[order[idom[block]]].append(order[block])
+        enter = {}
+        intervals = {}
+        counter = 0
+        stack = [(function.entry, False)]
+        while stack:
+            start, left = stack.pop()
+            if left:
+                intervals[start] = (enter[start], counter)
+            else:
+                enter[start] = counter
+                stack.append((start, True))
+                stack.extend((child, False) for child in children[start])
+            counter += 1
+        return intervals
+
+    def _longest_path(self, blocks: set[int], entry: int, ignored: set[tuple[int, int]],
+                      block_cost) -> int | None:
+        """
+        Longest path (in ticks) through an acyclic part of the graph
+        :param blocks: blocks of the subgraph
+        :param entry: entry block
+        :param ignored: ignored edges (back edges)
+        :param block_cost: function, which gives cost of a block (or None if unbounded)
+        :return: ticks, or None if the subgraph is cyclic or unbounded
+        """
+
+        successors = {}
+
+        # depth first search; orders the blocks after their successors, and finds cycles
+        order = []
+        visiting = {entry}
+        finished = set()
+        stack = [(entry, iter(self._successors(entry, blocks, ignored, successors)))]
+        while stack:
+            start, remaining = stack[-1]
+            for successor in remaining:
+                if successor in visiting:
+                    return None
+                if successor not in finished:
+                    visiting.add(successor)
+                    stack.append((successor, iter(self._successors(successor, blocks, ignored, successors))))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(start)
+                finished.add(start)
+                order.append(start)
+
+        # longest path from each block, successors first
+        longest: dict[int, int] = {}
+        for start in order:
+            cost = block_cost(start)
+            if cost is None:
+                return None
+            longest[start] = cost + max((longest[successor] for successor in successors[start]), default=0)
+        return longest[entry]
+
+    def _successors(self, start: int, blocks: set[int], ignored: set[tuple[int, int]],
+                    successors: dict[int, list[int]]) -> list[int]:
+        """
+        Successors of the block within the subgraph; stored into successors
+        """
+
+        successors[start] = [successor for successor in self.blocks[start].successors
+                             if successor in blocks and (start, successor) not in ignored]
+        return successors[start]
+
+    def _compute_costs(self):
+        """
+        Computes the worst case ticks of functions and loop iterations
+        """
+
+        # functions, callees first; recursive functions stay unbounded
+        resolving = set()
+
+        def function_ticks(entry: int) -> int | None:
+            function = self.functions[entry]
+            if entry in resolving:
+                return None
+            if function.worst_ticks is not None or function.loops or function.unresolved:
+                return function.worst_ticks
+            resolving.add(entry)
+            function.worst_ticks = self._longest_path(function.blocks, entry, set(), block_ticks)
+            resolving.discard(entry)
+            return function.worst_ticks
+
+        def block_ticks(start: int) -> int | None:
+            block = self.blocks[start]
+            ticks = block.ticks
+            for callee in block.calls:
+                callee_ticks = function_ticks(callee)
+                if callee_ticks is None:
+                    return None
+                ticks += callee_ticks
+            return ticks
+
+        for entry in self.functions:
+            function_ticks(entry)
+
+        # loop iterations; loops containing inner loops are unbounded
+        for loop in self.loops:
+            if any(other is not loop and other.header in loop.blocks for other in self.loops):
+                continue
+            ignored = {(start, loop.header) for start in loop.back_edges}
+            loop.iteration_ticks = self._longest_path(loop.blocks, loop.header, ignored, block_ticks)
+
+    def report(self):
+        """
+        Prints the analysis report
+        """
+
+        reachable = sum(len(block.instructions) for block in self.blocks.values())
+        print(f"Instructions   : {len(self.instructions)} ({reachable} reachable)")
+        print(f"Basic blocks   : {len(self.blocks)}")
+        print(f"Functions      : {len(self.functions)}")
+        print(f"Loops          : {len(self.loops)}")
+
+        print("\nFunctions:")
+        for function in self.functions.values():
+            name = "entry" if function.entry == 0 else f"func {function.entry}"
+            size = sum(len(self.blocks[start].instructions) for start in function.blocks)
+            if function.worst_ticks is not None:
+                ticks = f"{function.worst_ticks} ticks ({function.worst_ticks * InstructionSet.tick_time:.3f} sec)"
+            elif function.unresolved:
+                ticks = "unknown (unresolved jumps)"
+            else:
+                ticks = "unbounded (loops or recursion)"
+            calls = ", ".join(str(callee) for callee in sorted(function.calls)) or "-"
+            print(f"\t{name: <12} blocks {len(function.blocks): <5} instructions {size: <6} "
+                  f"calls {calls: <16} worst case {ticks}")
+
+        if self.loops:
+            print("\nLoops (by worst case ticks per iteration):")
+            loops = sorted(self.loops, key=lambda x: -1 if x.iteration_ticks is None else x.iteration_ticks, reverse=True)
+            for loop in loops:
+                size = sum(len(self.blocks[start].instructions) for start in loop.blocks)
+                ticks = f"{loop.iteration_ticks} ticks" if loop.iteration_ticks is not None else "unbounded"
+                print(f"\theader {loop.header: <6} function {loop.function: <6} depth {loop.depth: <3} "
+                      f"instructions {size: <6} per iteration {ticks}")
+
+        if self.unresolved:
+            print("\nUnresolved jumps and calls:")
+            for pc in self.unresolved:
+                print(f"\t{pc: <6} {self.instructions[pc]}")
@@ -1,4 +1,6 @@
 class InterruptRegister:
+    __slots__ = ("is_halted", "interrupt")
+
     def __init__(self):
         self.is_halted: bool = False
         self.interrupt: bool = False
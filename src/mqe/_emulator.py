@@ -1,23 +1,80 @@
 import math
-from time import perf_counter
-from types import ModuleType
-from typing import BinaryIO
+from typing import BinaryIO, Callable, TYPE_CHECKING
 from ._emu_types import *
+from ._executable import *
 from ._mqis import *
-from .ext import *
+from ._pacing import *
+from .ext import EXTENSIONS, load_extension
+
+if TYPE_CHECKING:
+    from ._trace import TraceWriter
+
+
+# memory layout; cache, stacks and ports are views into one contiguous buffer
+CACHE_SIZE: int = 2**16
+STACK_SIZE: int = 256
+PORTS_SIZE: int = 256
+MEMORY_SIZE: int = CACHE_SIZE + STACK_SIZE * 2 + PORTS_SIZE
+_ZERO_MEMORY: bytes = bytes(MEMORY_SIZE)
+
+# shared defaults for emulators without includes
+_NO_INTERRUPTS: tuple[None, ...] = (None,) * 256
+_NO_HOOKS: tuple = ()
 
 
 class Emulator:
-    INCLUDED_LIBS: dict[str, ModuleType] = {
-        "FileManager": FileManager,
-        "DisplayManager": DisplayManager,
-    }
+    __slots__ = (
+        "_acc", "_bacc", "_program_counter", "_acc_stack_pointer", "_adr_stack_pointer", "_carry_flag",
+        "interrupt_register", "_cache_page", "_rom_page",
+        "_rom", "_memory", "cache", "_acc_stack", "_adr_stack", "ports",
+        "_verbose", "_cpu_version", "_includes", "_interrupt_table", "_update_hooks", "_tracer",
+        "instruction_counter", "tick_counter", "interrupt_counts",
+    )
+
+    # extensions, which can be included by the executable. Each extension has a `process(emu)` method,
+    # declares the interrupt operations (`ports[0]` values) it handles in `INTERRUPTS`, and may have
+    # an `update()` method, which is called after each instruction.
+    # Extensions given as 'module:attribute' strings are imported only when they get included
+    INCLUDED_LIBS: dict[str, type | str] = dict(EXTENSIONS)
+
+    # instruction switch case (filled in after the class definition)
+    _INSTRUCTION_SET: tuple = ()
+
+    # entry point group for third party extensions
+    PLUGIN_GROUP: str = "mqe.extensions"
+    _plugins_discovered: bool = False
 
     def __init__(self, **kwargs):
         """
         Emulator class, which does do the emulation thing.
         """
 
+        # memory; cache and ports can be replaced with external (shared) buffers
+        self._memory: bytearray = bytearray(MEMORY_SIZE)
+        memory = memoryview(self._memory)
+        self.cache: memoryview | bytearray = memory[:CACHE_SIZE]
+        self._acc_stack: memoryview = memory[CACHE_SIZE:CACHE_SIZE + STACK_SIZE]
+        self._adr_stack: memoryview = memory[CACHE_SIZE + STACK_SIZE:CACHE_SIZE + STACK_SIZE * 2]
+        self.ports: memoryview | bytearray = memory[CACHE_SIZE + STACK_SIZE * 2:]
+        if kwargs.get("cache", None) is not None:
+            self.cache = kwargs["cache"]
+        if kwargs.get("ports", None) is not None:
+            self.ports = kwargs["ports"]
+
+        # emulator specific
+        self._verbose: bool = kwargs.get("verbose", False)
+        self._cpu_version: str = "1.1"
+        self._tracer: "TraceWriter | None" = kwargs.get("tracer", None)
+
+        # registers, program and counters
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the emulator to the state it had after construction, so it can be reused.
+        Emulator options, and the contents of external cache / ports buffers are kept
+        """
+
         # registers
         self._acc: int = 0                                                  # accumulator
         self._bacc: int = 0                                                 # baccumulator
@@ -33,27 +90,76 @@ class Emulator:
 
         # memory
         self._rom: bytearray = bytearray()
-        self.cache: bytearray = bytearray([0 for _ in range(2**16)])
-        self._acc_stack: bytearray = bytearray([0 for _ in range(256)])
-        self._adr_stack: bytearray = bytearray([0 for _ in range(256)])
-        self.ports: bytearray = bytearray([0 for _ in range(256)])
+        self._memory[:] = _ZERO_MEMORY
 
-        # emulator specific
-        self._verbose: bool = kwargs.get("verbose", False)
-        self._cpu_version: str = "1.1"
+        # includes
         self._includes: list[str] = []
+        self._interrupt_table: list[Callable | None] | tuple[None, ...] = _NO_INTERRUPTS
+        self._update_hooks: list[Callable] | tuple = _NO_HOOKS
 
         # instruction counting
         self.instruction_counter = 1
         self.tick_counter = 0
+        self.interrupt_counts: list[int] = [0] * 256                       # counts by interrupt operation
 
-        # instruction switch case
-        self._instruction_set: list = [None for _ in range(128)]
-        for i in range(128):
-            if hasattr(self, f"_is_{i}"):
-                self._instruction_set[i] = getattr(self, f"_is_{i}")
-            else:
-                self._instruction_set[i] = self._is__
+    @classmethod
+    def register_extension(cls, name: str, extension: type | str):
+        """
+        Registers an extension, which can then be included by name
+        :param name: include name
+        :param extension: extension class (or 'module:attribute' string, which is imported when it gets included)
+        """
+
+        cls.INCLUDED_LIBS[name] = extension
+
+    @classmethod
+    def discover_plugins(cls):
+        """
+        Registers third party extensions from the 'mqe.extensions' entry point group.
+        Built-in extensions can't be overridden.
+        """
+
+        if cls._plugins_discovered:
+            return
+        cls._plugins_discovered = True
+
+        # importlib.metadata is slow to import, so it's imported only when needed
+        from importlib.metadata import entry_points
+
+        for entry_point in entry_points(group=cls.PLUGIN_GROUP):
+            if entry_point.name not in cls.INCLUDED_LIBS:
+                cls.register_extension(entry_point.name, entry_point.value)
+
+    def _load_includes(self):
+        """
+        Imports the included extensions, and builds the interrupt dispatch table
+        """
+
+        if not self._includes:
+            return
+
+        self._interrupt_table = [None for _ in range(256)]
+        self._update_hooks = []
+        for include in self._includes:
+            if include not in self.INCLUDED_LIBS:
+                self.discover_plugins()
+            if include not in self.INCLUDED_LIBS:
+                self.print(f"WARN: incorrect include '{include}'")
+                continue
+
+            # import the extension
+            extension = self.INCLUDED_LIBS[include]
+            if isinstance(extension, str):
+                extension = load_extension(extension)
+                self.INCLUDED_LIBS[include] = extension
+            if hasattr(extension, "update"):
+                self._update_hooks.append(extension.update)
+
+            for operation in extension.INTERRUPTS:
+                if self._interrupt_table[operation] is not None:
+                    self.print(f"WARN: interrupt operation {operation} of '{include}' is already taken")
+                    continue
+                self._interrupt_table[operation] = extension.process
 
     def print(self, *values, sep: str | None = " ", end: str | None = "\n", flush: bool = False):
         if self._verbose:
@@ -65,82 +171,53 @@ class Emulator:
         :param file: binary file
         """
 
-        #               |                    : 10 bytes total
-        #               | cpuVersion         : 4  bytes - "1.1 "
-        # little_endian | includeSectionSize : 2  bytes - amount of bytes in include section
-        # little_endian | assemblySectionSize: 4  bytes - amount of bytes in code
-        # little_endian | includeSectionData : N  bytes - the include data
-        # little_endian | assemblySectionData: N  bytes - the code data
+        try:
+            executable = Executable.read(file)
+        except ValueError as e:
+            print(f"\nERROR: {e}")
+            exit(1)
+        self.load_executable(executable)
+
+    def load_executable(self, executable: Executable):
+        """
+        Loads the decoded executable into the ROM (Read-Only Memory)
+        :param executable: executable
+        """
 
-        cpu_version = file.read(4).decode('ASCII', 'replace')
-        include_section_size = int.from_bytes(file.read(2), 'little')
-        assembly_section_size = int.from_bytes(file.read(4), 'little')
         self.print("Header data:")
-        self.print(f"\tcpuVersion:          {cpu_version}")
-        self.print(f"\tincludeSectionSize:  {include_section_size}")
-        self.print(f"\tassemblySectionSize: {assembly_section_size}")
+        self.print(f"\tcpuVersion:          {executable.cpu_version}")
+        self.print(f"\tincludeSectionSize:  {sum(len(include) + 1 for include in executable.includes)}")
+        self.print(f"\tassemblySectionSize: {len(executable.rom)}")
         self.print("Header end.")
 
-        if include_section_size > 0:
+        if executable.includes:
             self.print("Include section start:")
-            include_section_data = bytearray()
-            for _ in range(include_section_size):
-                # fetch character
-                char = file.read(1)
-
-                # check EOF
-                if not char:
-                    print("\nERROR: file ended before the include section could be read fully")
-                    exit(1)
-
-                # if character is a newline, then it's a new include
-                if char == b'\n':
-                    try:
-                        decoded_include = include_section_data.decode('ASCII')
-                    except UnicodeDecodeError:
-                        print("\nERROR: unable to decode include name")
-                        exit(1)
-
-                    self._includes.append(decoded_include)
-                    self.print(f"\t> {decoded_include}")
-                    include_section_data.clear()
-
-                # otherwise append a character to the include section
-                else:
-                    include_section_data += char
+            for include in executable.includes:
+                self._includes.append(include)
+                self.print(f"\t> {include}")
             self.print("Include section end.")
 
         self.print("Assembly section start:")
-        for idx in range(0, assembly_section_size & 0b1_1111_1111_1111_1111, 2):
-            # fetch bytes
-            val_low = file.read(1)
-            val_high = file.read(1)
-
-            # check EOF
-            if not val_low or not val_high:
-                print("ERROR: file ended before the assembly section could be read fully")
-                exit(1)
-
-            # verbose print
-            if self._verbose:
-                value = (int.from_bytes(val_high) << 8) + int.from_bytes(val_low)
-
+        if self._verbose:
+            for opcode, data, memory_flag in executable.instructions():
                 # instruction mnemonic
-                mnemonic = InstructionSet.instruction_set.get(value & 127)["name"]
+                mnemonic = InstructionSet.instruction_set.get(opcode, {"name": "???"})["name"]
 
                 # if memory flag is on
-                if value >> 15:
-                    print(f"\t{mnemonic: <4} ${(value >> 7) & 255}")
+                if memory_flag:
+                    print(f"\t{mnemonic: <4} ${data}")
                 else:
-                    print(f"\t{mnemonic: <4} {(value >> 7) & 255}")
+                    print(f"\t{mnemonic: <4} {data}")
 
-            # write to rom
-            self._rom += val_low
-            self._rom += val_high
+        # write to rom
+        self._rom += executable.rom
         self.print(f"Assembly section end.")
 
+        # import the extensions
+        self._load_includes()
+
         # check versions
-        if float(self._cpu_version) < float(cpu_version.strip()):
+        if float(self._cpu_version) < float(executable.cpu_version.strip()):
             print("WARN: the executable file is for newer MQ version; some things may not work")
 
     def _check_carry(self):
@@ -410,26 +487,27 @@ class Emulator:
         Processes the interrupt
         """
 
+        # process the interrupt by the extension, which handles the operation
+        operation = self.ports[0]
+        self.interrupt_counts[operation] += 1
+        handler = self._interrupt_table[operation]
+        if handler is not None:
+            handler(self)
+
         # if there are no includes, then just die
-        if len(self._includes) == 0:
+        elif len(self._includes) == 0:
             self.interrupt_register.interrupt = True
             raise StopIteration
 
-        # process all the included libs
-        for include in self._includes:
-            if include not in self.INCLUDED_LIBS:
-                self.print(f"WARN: incorrect include '{include}'")
-
-            self.INCLUDED_LIBS[include].process(self)
-
     def execute_step(self):
         """
         Executes one step of the CPU
         """
 
         # fetch the instruction bytes
-        value_low = self._rom[self._program_counter * 2]
-        value_high = self._rom[self._program_counter * 2 + 1]
+        program_counter = self._program_counter
+        value_low = self._rom[program_counter * 2]
+        value_high = self._rom[program_counter * 2 + 1]
 
         # combine the instruction
         value = (value_high << 8) + value_low
@@ -445,37 +523,92 @@ class Emulator:
         else:
             rom_cache_bus = data
 
-        # execute instruction
-        self._instruction_set[opcode](rom_cache_bus)
-
-        # display manager
-        if DisplayManager.ROOT is not None and perf_counter() - DisplayManager.PREV_VALUE > DisplayManager.UPDATE_RATE:
-            DisplayManager.PREV_VALUE = perf_counter()
-            DisplayManager.ROOT.update()
+        # execute instruction; the instruction, which stops the program (HALT, unhandled INT,
+        # invalid opcode), is still traced, but it doesn't add to the counters
+        try:
+            self._INSTRUCTION_SET[opcode](self, rom_cache_bus)
+        except StopIteration:
+            if self._tracer is not None:
+                costs = InstructionSet.instruction_set.get(opcode)
+                ticks = (costs["cache"] if memory_flag else costs["ROM"]) if costs is not None else 0
+                self._tracer.record(
+                    program_counter, (memory_flag << 7) | opcode, data,
+                    rom_cache_bus, self._acc, self._carry_flag, ticks)
+            raise
+
+        # extension updates (display manager)
+        for hook in self._update_hooks:
+            hook()
 
         # add to time
         self.instruction_counter += 1
         if memory_flag:
-            self.tick_counter += InstructionSet.instruction_set[opcode]["cache"]
+            ticks = InstructionSet.instruction_set[opcode]["cache"]
         else:
-            self.tick_counter += InstructionSet.instruction_set[opcode]["ROM"]
+            ticks = InstructionSet.instruction_set[opcode]["ROM"]
+        self.tick_counter += ticks
+
+        # execution trace
+        if self._tracer is not None:
+            self._tracer.record(
+                program_counter, (memory_flag << 7) | opcode, data,
+                rom_cache_bus, self._acc, self._carry_flag, ticks)
 
         # increment the program counter
         self._program_counter += 1
 
-    def execute_whole(self):
+    def execute_ticks(self, ticks: int) -> bool:
+        """
+        Executes instructions until the given amount of ticks has passed
+        :param ticks: amount of ticks
+        :return: False if the program has stopped
+        """
+
+        target = self.tick_counter + ticks
+        try:
+            while self.tick_counter < target:
+                self.execute_step()
+        except StopIteration:
+            return False
+        except IndexError:
+            print("WARN: program counter overflow; halted", end="")
+            return False
+        return True
+
+    def execute_whole(self, pacer: Pacer | None = None, metrics=None):
         """
         Executes the entire file
+        :param pacer: when given, the execution is paced to match the in-game speed
+        :param metrics: when given, runtime metrics are sampled during the execution
         :return:
         """
 
         # execute the code
         try:
+            if pacer is None and metrics is None:
+                while True:
+                    self.execute_step()
+
+            # paced or monitored execution, checks the time after each batch of instructions
+            batch = range(min(monitor.batch for monitor in (pacer, metrics) if monitor is not None))
+            if pacer is not None:
+                pacer.start(self.tick_counter)
+            if metrics is not None:
+                metrics.start(self)
             while True:
-                self.execute_step()
+                for _ in batch:
+                    self.execute_step()
+                if pacer is not None:
+                    pacer.sync(self.tick_counter)
+                if metrics is not None:
+                    metrics.sync(self)
         except StopIteration:
             self.print("INFO: program called an interrupt, which didn't have a response", end="")
         except IndexError:
             print("WARN: program counter overflow; halted", end="")
         except KeyboardInterrupt:
             self.print("INFO: program was interrupted by the user", end="")
+
+
+# instruction switch case, shared by all emulators
+Emulator._INSTRUCTION_SET = tuple(getattr(Emulator, f"_is_{i}", Emulator._is__) for i in range(128))
@@ -0,0 +1,71 @@
+from typing import BinaryIO
+
+
+class Executable:
+    """
+    Decoded .mqa executable file
+    """
+
+    #               |                    : 10 bytes total
+    #               | cpuVersion         : 4  bytes - "1.1 "
+    # little_endian | includeSectionSize : 2  bytes - amount of bytes in include section
+    # little_endian | assemblySectionSize: 4  bytes - amount of bytes in code
+    # little_endian | includeSectionData : N  bytes - the include data
+    # little_endian | assemblySectionData: N  bytes - the code data
+
+    def __init__(self, cpu_version: str, includes: list[str], rom: bytes):
+        """
+        :param cpu_version: CPU version the executable was made for
+        :param includes: included extension names
+        :param rom: assembly section (2 bytes per instruction, little endian)
+        """
+
+        self.cpu_version: str = cpu_version
+        self.includes: list[str] = includes
+        self.rom: bytes = rom
+
+    def __len__(self) -> int:
+        """
+        :return: amount of instructions
+        """
+
+        return len(self.rom) // 2
+
+    def instructions(self):
+        """
+        Iterates over decoded instructions
+        :return: (opcode, data, memory_flag) tuples
+        """
+
+        for idx in range(0, len(self.rom), 2):
+            value = (self.rom[idx + 1] << 8) + self.rom[idx]
+            yield value & 0b111_1111, (value >> 7) & 0b1111_1111, value >> 15
+
+    @classmethod
+    def read(cls, file: BinaryIO) -> "Executable":
+        """
+        Reads the executable file
+        :param file: binary file
+        :return: executable
+        """
+
+        cpu_version = file.read(4).decode('ASCII', 'replace')
+        include_section_size = int.from_bytes(file.read(2), 'little')
+        assembly_section_size = int.from_bytes(file.read(4), 'little')
+
+        # include section; each include ends with a newline
+        include_section_data = file.read(include_section_size)
+        if len(include_section_data) != include_section_size:
+            raise ValueError("file ended before the include section could be read fully")
+        try:
+            includes = include_section_data.decode('ASCII').split("\n")[:-1]
+        except UnicodeDecodeError:
+            raise ValueError("unable to decode include name")
+
+        # assembly section; the size is rounded up to whole instructions
+        rom_size = len(range(0, assembly_section_size & 0b1_1111_1111_1111_1111, 2)) * 2
+        rom = file.read(rom_size)
+        if len(rom) != rom_size:
+            raise ValueError("file ended before the assembly section could be read fully")
+
+        return cls(cpu_version, includes, rom)
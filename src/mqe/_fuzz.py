@@ -0,0 +1,296 @@
+import os
+import random
+import contextlib
+import multiprocessing
+from typing import Callable
+from ._mqis import *
+from ._emulator import Emulator
+from ._executable import Executable
+from ._pool import EmulatorPool
+
+
+"""
+Differential fuzzing. Random, well-formed programs are run on the reference step interpreter
+and on every other registered engine, and the full emulator state is compared at checkpoints.
+
+Checkpoints are measured in ticks: a state is taken after the first instruction at which the tick
+counter reached the previous checkpoint plus the interval (which is what Emulator.execute_ticks does).
+Failing programs are shrunk to a smaller program, which still makes the engines disagree.
+"""
+
+
+# (opcode, data, memory_flag)
+Program = list[tuple[int, int, int]]
+
+# opcodes, which take a ROM address as the operand
+_JUMPS = (3, 5, 6, 7, 8, 9)
+_CRP = 13
+
+# opcodes used in random programs; UI needs user input
+_OPCODES = tuple(opcode for opcode in InstructionSet.instruction_set if opcode != 48)
+
+# engines; each one runs the executable and returns the states at checkpoints
+ENGINES: dict[str, Callable[[Executable, int, int], list[tuple]]] = {}
+
+
+def engine(name: str):
+    """
+    Registers an engine. The engine is called with (executable, max_ticks, interval) and returns
+    a list of states (see capture_state); one after each checkpoint, and the final one
+    """
+
+    def decorator(function):
+        ENGINES[name] = function
+        return function
+    return decorator
+
+
+def capture_state(emu: Emulator, error: str | None = None) -> tuple:
+    """
+    :param emu: emulator
+    :param error: name of the exception, which stopped the emulator
+    :return: full emulator state
+    """
+
+    return (
+        emu._program_counter, emu._acc, emu._bacc, emu._carry_flag,
+        emu._acc_stack_pointer, emu._adr_stack_pointer, emu._cache_page, emu._rom_page,
+        emu.interrupt_register.is_halted, emu.interrupt_register.interrupt,
+        emu.instruction_counter, emu.tick_counter,
+        bytes(emu.cache), bytes(emu._acc_stack), bytes(emu._adr_stack), bytes(emu.ports),
+        error,
+    )
+
+
+STATE_FIELDS = (
+    "program counter", "acc", "bacc", "carry flag", "acc stack pointer", "address stack pointer",
+    "cache page", "ROM page", "halted", "interrupt", "instruction counter", "tick counter",
+    "cache", "acc stack", "address stack", "ports", "error",
+)
+
+
+def _run_steps(emu: Emulator, max_ticks: int, interval: int) -> list[tuple]:
+    """
+    Runs the emulator with execute_step, taking the states at checkpoints
+    """
+
+    states = []
+    checkpoint = interval
+    try:
+        while emu.tick_counter < max_ticks:
+            emu.execute_step()
+            if checkpoint <= emu.tick_counter < max_ticks:
+                states.append(capture_state(emu))
+                checkpoint = emu.tick_counter + interval
+    except (StopIteration, IndexError):
+        pass
+    except Exception as e:
+        states.append(capture_state(emu, type(e).__name__))
+        return states
+    states.append(capture_state(emu))
+    return states
+
+
+@engine("step")
+def _step_engine(executable: Executable, max_ticks: int, interval: int) -> list[tuple]:
+    """
+    Reference interpreter; new emulator, one execute_step at a time
+    """
+
+    emu = Emulator()
+    emu.load_executable(executable)
+    return _run_steps(emu, max_ticks, interval)
+
+
+@engine("ticks")
+def _ticks_engine(executable: Executable, max_ticks: int, interval: int) -> list[tuple]:
+    """
+    Emulator.execute_ticks slices, as used by System and the job server
+    """
+
+    emu = Emulator()
+    emu.load_executable(executable)
+    states = []
+    try:
+        while emu.tick_counter < max_ticks:
+            if not emu.execute_ticks(min(interval, max_ticks - emu.tick_counter)):
+                break
+            if emu.tick_counter < max_ticks:
+                states.append(capture_state(emu))
+    except Exception as e:
+        states.append(capture_state(emu, type(e).__name__))
+        return states
+    states.append(capture_state(emu))
+    return states
+
+
+_POOL = EmulatorPool(max_idle=1)
+
+
+@engine("pooled")
+def _pooled_engine(executable: Executable, max_ticks: int, interval: int) -> list[tuple]:
+    """
+    Emulator reused through EmulatorPool, so it has run the previous programs before being reset
+    """
+
+    emu = _POOL.acquire()
+    try:
+        emu.load_executable(executable)
+        return _run_steps(emu, max_ticks, interval)
+    finally:
+        _POOL.release(emu)
+
+
+def generate_program(rng: random.Random, max_length: int = 64) -> Program:
+    """
+    Generates a random program. Jump targets stay within the program, and the ROM page stays 0
+    :param rng: random number generator
+    :param max_length: maximum amount of instructions
+    :return: program, which ends with HALT
+    """
+
+    length = rng.randint(1, max_length)
+    program = []
+    for _ in range(length):
+        opcode = rng.choice(_OPCODES)
+        if opcode in _JUMPS:
+            program.append((opcode, rng.randrange(length + 1), 0))
+        elif opcode == _CRP:
+            program.append((opcode, 0, 0))
+        else:
+            program.append((opcode, rng.randrange(256), int(rng.random() < 0.25)))
+    program.append((127, 0, 0))
+    return program
+
+
+def make_executable(program: Program) -> Executable:
+    """
+    :param program: program
+    :return: executable without includes
+    """
+
+    rom = bytearray()
+    for opcode, data, memory_flag in program:
+        rom += ((memory_flag << 15) | (data << 7) | opcode).to_bytes(2, "little")
+    return Executable("1.1 ", [], bytes(rom))
+
+
+def compare(program: Program, engines: list[str], max_ticks: int, interval: int) -> str | None:
+    """
+    Runs the program on the reference and the given engines
+    :return: description of the first difference, or None if all engines agree
+    """
+
+    executable = make_executable(program)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        reference = ENGINES["step"](executable, max_ticks, interval)
+        for name in engines:
+            states = ENGINES[name](executable, max_ticks, interval)
+            if len(states) != len(reference):
+                return f"'{name}' took {len(states)} checkpoints, reference took {len(reference)}"
+            for index, (state, expected) in enumerate(zip(states, reference)):
+                if state != expected:
+                    fields = [field for field, a, b in zip(STATE_FIELDS, state, expected) if a != b]
+                    return f"'{name}' differs at checkpoint {index} in: {', '.join(fields)}"
+    return None
+
+
+def shrink(program: Program, engines: list[str], max_ticks: int, interval: int) -> Program:
+    """
+    Makes the failing program smaller, while it keeps failing.
+    Instructions are replaced with NOPs (instead of being removed) to keep the jump targets
+    """
+
+    def fails(candidate: Program) -> bool:
+        return compare(candidate, engines, max_ticks, interval) is not None
+
+    # cut the tail off
+    for length in range(1, len(program)):
+        candidate = program[:length] + [(127, 0, 0)]
+        if fails(candidate):
+            program = candidate
+            break
+
+    # replace instructions with NOPs, then simplify the operands
+    changed = True
+    while changed:
+        changed = False
+        for index, (opcode, data, memory_flag) in enumerate(program[:-1]):
+            for replacement in ((0, 0, 0), (opcode, data, 0), (opcode, 0, 0)):
+                if replacement == program[index] or (replacement[0] in _JUMPS and replacement[1] != data):
+                    continue
+                candidate = program[:index] + [replacement] + program[index + 1:]
+                if fails(candidate):
+                    program = candidate
+                    changed = True
+                    break
+    return program
+
+
+def disassemble(program: Program) -> str:
+    return "\n".join(
+        f"\t{pc: <4} {InstructionSet.instruction_set[opcode]['name']: <4} {'$' if memory_flag else ''}{data}"
+        for pc, (opcode, data, memory_flag) in enumerate(program))
+
+
+def fuzz_batch(seed: int, count: int, engines: list[str], max_ticks: int, interval: int) -> tuple[int, list]:
+    """
+    Runs a batch of random programs
+    :param seed: seed of the first program
+    :param count: amount of programs
+    :param engines: compared engines
+    :param max_ticks: tick budget of each program
+    :param interval: checkpoint interval in ticks
+    :return: amount of programs run and the failures (seed, shrunk program, difference)
+    """
+
+    failures = []
+    for index in range(count):
+        program_seed = seed + index
+        program = generate_program(random.Random(program_seed))
+        if compare(program, engines, max_ticks, interval) is not None:
+            program = shrink(program, engines, max_ticks, interval)
+            failures.append((program_seed, program, compare(program, engines, max_ticks, interval)))
+    return count, failures
+
+
+def fuzz(count: int, engines: list[str] | None = None, jobs: int | None = None, seed: int = 0,
+         max_ticks: int = 13 * 1000, interval: int = 13 * 50, batch: int = 100, on_progress=None) -> list:
+    """
+    Runs the differential fuzzing across several processes
+    :param count: amount of programs
+    :param engines: compared engines (all except the reference by default)
+    :param jobs: amount of processes (cpu count by default)
+    :param seed: seed of the first program
+    :param max_ticks: tick budget of each program
+    :param interval: checkpoint interval in ticks
+    :param batch: amount of programs per task
+    :param on_progress: function called with (programs done, failures found)
+    :return: failures (seed, shrunk program, difference)
+    :raises ValueError: when max_ticks, interval or jobs is not positive
+    """
+
+    # execute_ticks(0) doesn't make progress, so a zero interval would never finish
+    if max_ticks <= 0:
+        raise ValueError("max_ticks must be positive")
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    if jobs is not None and jobs <= 0:
+        raise ValueError("jobs must be positive")
+
+    engines = engines if engines is not None else [name for name in ENGINES if name != "step"]
+    tasks = [(seed + start, min(batch, count - start), engines, max_ticks, interval) for start in range(0, count, batch)]
+
+    done = 0
+    failures = []
+    with multiprocessing.get_context().Pool(jobs) as pool:
+        for batch_count, batch_failures in pool.imap_unordered(_fuzz_task, tasks):
+            done += batch_count
+            failures.extend(batch_failures)
+            if on_progress is not None:
+                on_progress(done, len(failures))
+    return failures
+
+
+def _fuzz_task(task: tuple) -> tuple[int, list]:
+    return fuzz_batch(*task)
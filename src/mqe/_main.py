@@ -1,12 +1,29 @@
 import os
+import sys
 import argparse
-from . import Emulator
+from time import perf_counter
+from ._emulator import Emulator
+from ._executable import Executable
+from ._pacing import Pacer
+from ._mqis import InstructionSet
 
 
-parser = argparse.ArgumentParser(prog="mqe", description="Emulates .mqa execution files for Mini Quantum CPU")
-parser.add_argument("input", type=str, help="executable file")
+parser = argparse.ArgumentParser(prog="mqe", description="Emulates .mqa execution files for Mini Quantum CPU",
+                                 epilog="other commands: mqe analyze FILE, mqe serve, mqe submit FILE, mqe fuzz")
+parser.add_argument("input", type=str, nargs="+", help="executable file (several files are run as a multi-CPU system)")
 parser.add_argument("-v", "--verbose", help="be verbose", action="store_true")
-args = parser.parse_args()
+parser.add_argument("--speed", type=str, default="max", help="execution speed; 1x is in-game speed (default: max)")
+parser.add_argument("--shared-cache", help="CPUs of a multi-CPU system share the cache", action="store_true")
+parser.add_argument("--processes", help="run each CPU of a multi-CPU system in its own process", action="store_true")
+parser.add_argument("--status", help="show a live status line with runtime metrics", action="store_true")
+parser.add_argument("--metrics-prom", type=str, metavar="FILE", help="keep runtime metrics in a Prometheus text file")
+parser.add_argument("--metrics-json", type=str, metavar="FILE", help="append runtime metrics to a JSON lines file")
+parser.add_argument("--metrics-interval", type=int, default=65536, help="instructions between metric checks")
+parser.add_argument("--metrics-period", type=float, default=1, help="seconds between metric samples")
+parser.add_argument("--trace", type=str, metavar="FILE", help="record the execution trace into a binary file")
+parser.add_argument("--trace-compress", help="compress the execution trace", action="store_true")
+parser.add_argument("--trace-dump", help="print the input trace file as text", action="store_true")
+parser.add_argument("--trace-stats", help="print the input trace file statistics", action="store_true")
 
 
 def pretty_time(time: int | float) -> str:
@@ -66,28 +83,297 @@ def die(message=None):
     exit(1)
 
 
-def main():
-    # file reading
+def run_system(args: argparse.Namespace, pacer: Pacer | None):
+    """
+    Runs several executables as a multi-CPU system
+    :param args: command line arguments
+    :param pacer: pacer
+    """
+
+    from ._system import System
+
+    if args.trace is not None:
+        die("tracing is not supported for multi-CPU systems")
+    if args.status or args.metrics_prom is not None or args.metrics_json is not None:
+        die("metrics are not supported for multi-CPU systems")
+    if args.processes and pacer is not None:
+        die("pacing is not supported for multi-process systems")
+
+    # initialize the system
+    system = System(share_cache=args.shared_cache, verbose=args.verbose)
+    for path in args.input:
+        with open(path, "rb") as file:
+            system.add(file.read())
+
+    # make a separator
+    print(f"\n{'=' * 120}\n")
+
+    # run emulation
+    try:
+        if args.processes:
+            system.run_processes()
+        else:
+            system.run(pacer)
+    except RuntimeError as e:
+        die(str(e))
+
+    # print out the result
+    print(f"\n\n{'=' * 120}\n")
+    for path, cpu in zip(args.input, system.cpus):
+        print(f"CPU '{path}'")
+        print(f"\tFinished after : {cpu.instruction_counter} instructions")
+        print(f"\tTime in ticks  : {cpu.tick_counter} ticks")
+    ticks = max(cpu.tick_counter for cpu in system.cpus)
+    print(f"Time in seconds: {ticks * InstructionSet.tick_time:.4f} sec")
+    print(f"Compressed time: {pretty_time(ticks * InstructionSet.tick_time)}")
+    if pacer is not None:
+        print(f"Target speed   : {pacer.speed:g}x")
+        print(f"Achieved speed : {pacer.achieved_speed(ticks):.4f}x")
+
+
+def analyze(argv: list[str]):
+    """
+    Analyzes the control flow and tick costs of the executable
+    :param argv: command line arguments
+    """
+
+    from ._analysis import ControlFlowGraph
+
+    parser = argparse.ArgumentParser(prog="mqe analyze", description="Statically analyzes .mqa execution files")
+    parser.add_argument("input", type=str, help="executable file")
+    args = parser.parse_args(argv)
     if not os.path.isfile(args.input):
         die(f"file '{args.input}' not found")
 
-    # initialize the emulator
-    emulator = Emulator(verbose=args.verbose)
     with open(args.input, "rb") as file:
+        try:
+            executable = Executable.read(file)
+        except ValueError as e:
+            die(str(e))
+    ControlFlowGraph(executable.rom).report()
+
+
+def serve(argv: list[str]):
+    """
+    Runs the job server
+    :param argv: command line arguments
+    """
+
+    from ._server import JobServer
+
+    parser = argparse.ArgumentParser(prog="mqe serve", description="Runs submitted jobs on a pool of warm workers")
+    parser.add_argument("--socket", type=str, help="listen on a Unix socket instead of localhost TCP")
+    parser.add_argument("--port", type=int, default=8765, help="localhost TCP port (default: 8765)")
+    parser.add_argument("--workers", type=int, help="amount of worker processes (default: cpu count)")
+    parser.add_argument("--queue", type=int, default=64, help="amount of waiting jobs before rejecting new ones")
+    parser.add_argument("--allow-include", type=str, action="append", default=[], metavar="NAME",
+                        help="allow executables with this include (none by default; FileManager gives the jobs "
+                             "access to the server's files)")
+    parser.add_argument("--allow-paths", action="store_true",
+                        help="allow jobs, which make the server read the executable from a path")
+    parser.add_argument("--max-job-seconds", type=float, default=60,
+                        help="maximum (and default) timeout of the jobs; 0 for no limit (default: 60)")
+    parser.add_argument("--max-job-ticks", type=int, default=0,
+                        help="maximum (and default) tick limit of the jobs; 0 for no limit (default: 0)")
+    args = parser.parse_args(argv)
+    address = args.socket if args.socket is not None else ("127.0.0.1", args.port)
+    try:
+        server = JobServer(address, workers=args.workers, queue_size=args.queue,
+                           allowed_includes=args.allow_include, allow_paths=args.allow_paths,
+                           max_job_seconds=args.max_job_seconds or None, max_job_ticks=args.max_job_ticks or None)
+    except OSError as e:
+        die(f"unable to listen on {address}: {e}")
+    print(f"INFO: serving on {address} with {server.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("INFO: server was interrupted by the user")
+
+
+def submit(argv: list[str]):
+    """
+    Submits jobs to the job server, and prints their output and counters
+    :param argv: command line arguments
+    """
+
+    from ._server import Client
+
+    parser = argparse.ArgumentParser(prog="mqe submit", description="Submits jobs to a running 'mqe serve'")
+    parser.add_argument("input", type=str, nargs="+", help="executable file (several files run concurrently)")
+    parser.add_argument("--socket", type=str, help="connect to a Unix socket instead of localhost TCP")
+    parser.add_argument("--port", type=int, default=8765, help="localhost TCP port (default: 8765)")
+    parser.add_argument("--send-path", help="send the file path instead of its contents", action="store_true")
+    parser.add_argument("--stdin", type=str, default="", help="program input")
+    parser.add_argument("--max-instructions", type=int, help="stop the program after this many instructions")
+    parser.add_argument("--max-ticks", type=int, help="stop the program after this many ticks")
+    parser.add_argument("--timeout", type=float, help="stop the program after this many seconds")
+    args = parser.parse_args(argv)
+    for path in args.input:
+        if not os.path.isfile(path):
+            die(f"file '{path}' not found")
+
+    limits = {name: getattr(args, name) for name in ("max_instructions", "max_ticks", "timeout")
+              if getattr(args, name) is not None}
+    jobs = [Client.job(path, send_rom=not args.send_path, input=args.stdin, **limits) for path in args.input]
+
+    # a single job's output is streamed, several jobs are printed one after another
+    client = Client(args.socket if args.socket is not None else ("127.0.0.1", args.port))
+    streamed = len(jobs) == 1
+    try:
+        results = client.run(jobs, on_output=(lambda _, output: print(output, end="", flush=True)) if streamed else None)
+    except OSError as e:
+        die(f"unable to connect to the server: {e}")
+
+    for path, result in zip(args.input, results):
+        if not streamed:
+            print(f"\n{'=' * 120}\n{path}\n")
+            print(result["output"], end="")
+        print(f"\n\n{'=' * 120}\n")
+        print(f"Status         : {result['status']}" + (f" ({result['error']})" if "error" in result else ""))
+        print(f"Finished after : {result.get('instructions', 0)} instructions")
+        print(f"Time in ticks  : {result.get('ticks', 0)} ticks")
+        print(f"Run time       : {result.get('time', 0):.4f} sec")
+
+
+def fuzz(argv: list[str]):
+    """
+    Runs the differential fuzzing; exits with 1 when the engines disagree
+    :param argv: command line arguments
+    """
+
+    from ._fuzz import ENGINES, fuzz as run_fuzz, disassemble
+
+    parser = argparse.ArgumentParser(prog="mqe fuzz", description="Compares execution engines on random programs")
+    parser.add_argument("-n", "--count", type=int, default=10000, help="amount of programs (default: 10000)")
+    parser.add_argument("-j", "--jobs", type=int, help="amount of processes (default: cpu count)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first program (default: 0)")
+    parser.add_argument("--engines", type=str, help="comma separated engines to compare (default: all)")
+    parser.add_argument("--max-ticks", type=int, default=13000, help="tick budget of each program")
+    parser.add_argument("--interval", type=int, default=650, help="checkpoint interval in ticks")
+    args = parser.parse_args(argv)
+    if args.max_ticks <= 0:
+        die("--max-ticks must be positive")
+    if args.interval <= 0:
+        die("--interval must be positive")
+    if args.jobs is not None and args.jobs <= 0:
+        die("--jobs must be positive")
+    engines = None
+    if args.engines is not None:
+        engines = [name.strip() for name in args.engines.split(",") if name.strip()]
+        for name in engines:
+            if name not in ENGINES:
+                die(f"unknown engine '{name}'; available: {', '.join(ENGINES)}")
+
+    start = perf_counter()
+    failures = run_fuzz(
+        args.count, engines, jobs=args.jobs, seed=args.seed, max_ticks=args.max_ticks, interval=args.interval,
+        on_progress=lambda done, failed: print(f"\rPrograms: {done}/{args.count}, failures: {failed}", end="", flush=True))
+    print(f"\nFinished in {perf_counter() - start:.2f} sec")
+
+    for seed, program, difference in failures:
+        print(f"\nFAIL seed {seed}: {difference}")
+        print(disassemble(program))
+    if failures:
+        exit(1)
+
+
+# subcommands (mqe COMMAND ...)
+COMMANDS = {
+    "analyze": analyze,
+    "serve": serve,
+    "submit": submit,
+    "fuzz": fuzz,
+}
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+        return
+    args = parser.parse_args(argv)
+
+    # file reading
+    for path in args.input:
+        if not os.path.isfile(path):
+            die(f"file '{path}' not found")
+
+    # trace reading
+    if args.trace_dump or args.trace_stats:
+        if len(args.input) > 1:
+            die("only one trace file can be read at a time")
+        from ._trace import TraceReader
+        reader = TraceReader(args.input[0])
+        try:
+            if args.trace_dump:
+                reader.dump()
+            if args.trace_stats:
+                reader.stats()
+        except ValueError as e:
+            die(str(e))
+        return
+
+    # execution speed
+    try:
+        speed = Pacer.parse_speed(args.speed)
+    except ValueError:
+        die(f"invalid speed '{args.speed}'")
+    pacer = Pacer(speed) if speed is not None else None
+
+    # multi-CPU system
+    if len(args.input) > 1:
+        run_system(args, pacer)
+        return
+
+    # trace writing
+    tracer = None
+    if args.trace is not None:
+        from ._trace import TraceWriter
+        try:
+            tracer = TraceWriter(args.trace, compress=args.trace_compress)
+        except OSError as e:
+            die(f"unable to write trace: {e}")
+
+    # runtime metrics
+    metrics = None
+    if args.status or args.metrics_prom is not None or args.metrics_json is not None:
+        if args.metrics_interval <= 0:
+            die("metrics interval must be positive")
+        from ._metrics import Metrics
+        metrics = Metrics(args.metrics_interval, args.metrics_period, status=args.status,
+                          prometheus_path=args.metrics_prom, json_path=args.metrics_json)
+
+    # initialize the emulator
+    emulator = Emulator(verbose=args.verbose, tracer=tracer)
+    with open(args.input[0], "rb") as file:
         emulator.load_binary_file(file)
 
     # make a separator
     print(f"\n{'=' * 120}\n")
 
-    # run emulation
-    emulator.execute_whole()
+    # run emulation; the trace is closed even when the program crashes
+    try:
+        try:
+            emulator.execute_whole(pacer, metrics)
+        finally:
+            if metrics is not None:
+                metrics.finish(emulator)
+            if tracer is not None:
+                tracer.close()
+    except OSError as e:
+        if tracer is None or e is not tracer.error:
+            raise
+        die(f"unable to write trace: {e}")
 
     # print out the result
     print(f"\n\n{'=' * 120}\n")
     print(f"Finished after : {emulator.instruction_counter} instructions")
     print(f"Time in ticks  : {emulator.tick_counter} ticks")
-    print(f"Time in seconds: {emulator.tick_counter * 0.025:.4f} sec")
-    print(f"Compressed time: {pretty_time(emulator.tick_counter * 0.025)}")
+    print(f"Time in seconds: {emulator.tick_counter * InstructionSet.tick_time:.4f} sec")
+    print(f"Compressed time: {pretty_time(emulator.tick_counter * InstructionSet.tick_time)}")
+    if pacer is not None:
+        print(f"Target speed   : {pacer.speed:g}x")
+        print(f"Achieved speed : {pacer.achieved_speed(emulator.tick_counter):.4f}x")
 
 
 if __name__ == '__main__':
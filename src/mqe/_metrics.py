@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+from time import perf_counter, time
+from ._mqis import *
+
+
+"""
+Runtime metrics. The emulator calls Metrics.sync after each batch of instructions;
+at most once per period a sample is taken, and written to the enabled outputs:
+a live status line, a Prometheus text file, or a JSON lines log.
+"""
+
+
+class Metrics:
+    """
+    Samples the emulator counters, and computes the rates.
+    """
+
+    def __init__(self, interval: int = 65536, period: float = 1, status: bool = False,
+                 prometheus_path: str | None = None, json_path: str | None = None):
+        """
+        :param interval: amount of instructions between checks
+        :param period: minimum time between samples in seconds
+        :param status: print a live status line to stderr
+        :param prometheus_path: Prometheus text file, which is rewritten on each sample
+        :param json_path: JSON lines file, which gets a line appended on each sample
+        """
+
+        self.batch: int = interval
+        self.period: float = period
+        self.status: bool = status
+        self.prometheus_path: str | None = prometheus_path
+        self.json_path: str | None = json_path
+
+        # previous sample
+        self._start_time: float = 0
+        self._prev_time: float = 0
+        self._prev_instructions: int = 0
+        self._prev_ticks: int = 0
+
+    def start(self, emu):
+        """
+        Sets the reference point
+        :param emu: emulator
+        """
+
+        self._start_time = self._prev_time = perf_counter()
+        self._prev_instructions = emu.instruction_counter
+        self._prev_ticks = emu.tick_counter
+
+    def sync(self, emu):
+        """
+        Takes a sample, if the period has passed
+        :param emu: emulator
+        """
+
+        if perf_counter() - self._prev_time >= self.period:
+            self.emit(self.sample(emu))
+
+    def finish(self, emu):
+        """
+        Takes the final sample
+        :param emu: emulator
+        """
+
+        self.emit(self.sample(emu))
+        if self.status:
+            print(file=sys.stderr)
+
+    def sample(self, emu) -> dict:
+        """
+        :param emu: emulator
+        :return: counters and rates since the previous sample
+        """
+
+        now = perf_counter()
+        elapsed = max(now - self._prev_time, 1e-9)
+        ips = (emu.instruction_counter - self._prev_instructions) / elapsed
+        tps = (emu.tick_counter - self._prev_ticks) / elapsed
+        self._prev_time = now
+        self._prev_instructions = emu.instruction_counter
+        self._prev_ticks = emu.tick_counter
+
+        sample = {
+            "timestamp": time(),
+            "elapsed": now - self._start_time,
+            "instructions": emu.instruction_counter,
+            "ticks": emu.tick_counter,
+            "instructions_per_second": ips,
+            "ticks_per_second": tps,
+            "realtime_ratio": tps * InstructionSet.tick_time,
+            "interrupts": self._interrupts(emu),
+        }
+
+        # extension counters; only if the extension was imported
+        file_system = sys.modules.get("mqe.ext._file_system")
+        if file_system is not None:
+            sample["file_bytes_read"] = file_system.FileManager.BYTES_READ
+            sample["file_bytes_written"] = file_system.FileManager.BYTES_WRITTEN
+        display = sys.modules.get("mqe.ext._display")
+        if display is not None:
+            sample["display_frames_drawn"] = display.DisplayManager.FRAMES_DRAWN
+            sample["display_frames_dropped"] = display.DisplayManager.FRAMES_DROPPED
+        return sample
+
+    @staticmethod
+    def _interrupts(emu) -> dict[str, int]:
+        """
+        :return: interrupt counts per extension ('unhandled' for operations without one)
+        """
+
+        owners = {}
+        for include in emu._includes:
+            extension = emu.INCLUDED_LIBS.get(include)
+            for operation in getattr(extension, "INTERRUPTS", ()):
+                owners.setdefault(operation, include)
+
+        counts = {}
+        for operation, count in enumerate(emu.interrupt_counts):
+            if not count:
+                continue
+            owner = owners.get(operation, "unhandled")
+            counts[owner] = counts.get(owner, 0) + count
+        return counts
+
+    def emit(self, sample: dict):
+        """
+        Writes the sample to the enabled outputs
+        :param sample: sample
+        """
+
+        if self.status:
+            self._write_status(sample)
+        if self.prometheus_path is not None:
+            self._write_prometheus(sample)
+        if self.json_path is not None:
+            with open(self.json_path, "a") as file:
+                file.write(json.dumps(sample) + "\n")
+
+    @staticmethod
+    def _write_status(sample: dict):
+        line = (f"{sample['instructions']:,} instr | {sample['instructions_per_second']:,.0f} IPS | "
+                f"{sample['ticks_per_second']:,.0f} ticks/s | {sample['realtime_ratio']:,.1f}x real-time")
+        if sample["interrupts"]:
+            line += " | INT " + ", ".join(f"{name} {count:,}" for name, count in sample["interrupts"].items())
+        if "file_bytes_read" in sample:
+            line += f" | file {sample['file_bytes_read']:,}B in, {sample['file_bytes_written']:,}B out"
+        if "display_frames_drawn" in sample:
+            line += f" | frames {sample['display_frames_drawn']:,} ({sample['display_frames_dropped']:,} dropped)"
+        print(f"\r\x1b[K{line}", end="", file=sys.stderr, flush=True)
+
+    def _write_prometheus(self, sample: dict):
+        lines = [
+            "# TYPE mqe_instructions_total counter",
+            f"mqe_instructions_total {sample['instructions']}",
+            "# TYPE mqe_ticks_total counter",
+            f"mqe_ticks_total {sample['ticks']}",
+            "# TYPE mqe_instructions_per_second gauge",
+            f"mqe_instructions_per_second {sample['instructions_per_second']:.3f}",
+            "# TYPE mqe_ticks_per_second gauge",
+            f"mqe_ticks_per_second {sample['ticks_per_second']:.3f}",
+            "# TYPE mqe_realtime_ratio gauge",
+            f"mqe_realtime_ratio {sample['realtime_ratio']:.3f}",
+            "# TYPE mqe_interrupts_total counter",
+        ]
+        lines += [f'mqe_interrupts_total{{extension="{name}"}} {count}' for name, count in sample["interrupts"].items()]
+        if "file_bytes_read" in sample:
+            lines += [
+                "# TYPE mqe_file_bytes_total counter",
+                f'mqe_file_bytes_total{{direction="read"}} {sample["file_bytes_read"]}',
+                f'mqe_file_bytes_total{{direction="written"}} {sample["file_bytes_written"]}',
+            ]
+        if "display_frames_drawn" in sample:
+            lines += [
+                "# TYPE mqe_display_frames_total counter",
+                f'mqe_display_frames_total{{state="drawn"}} {sample["display_frames_drawn"]}',
+                f'mqe_display_frames_total{{state="dropped"}} {sample["display_frames_dropped"]}',
+            ]
+
+        # replace the file at once, so scrapers never see a partial file
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
@@ -1,4 +1,6 @@
 class InstructionSet:
+    tick_time = 0.025   # seconds per game tick (40 ticks per second)
+
     instruction_set = {
         0:      {"name": "NOP",     "ROM": 13,  "cache": 13},
         1:      {"name": "LRA",     "ROM": 13,  "cache": 13},
@@ -0,0 +1,98 @@
+import math
+from time import perf_counter, sleep
+from ._mqis import *
+
+
+"""
+Real-time pacing. The emulator runs in batches of instructions, and after each batch
+the pacer compares emulated time (ticks) with the wall clock and sleeps off the difference.
+"""
+
+
+class Pacer:
+    """
+    Meters the execution against the MQ tick cost model.
+    """
+
+    def __init__(self, speed: float, interval: float = 0.02, min_sleep: float = 0.005):
+        """
+        :param speed: speed multiplier (1 is in-game speed)
+        :param interval: approximate wall time between pacing checks in seconds
+        :param min_sleep: sleeps shorter than this are postponed until the next batch
+        """
+
+        self.speed: float = speed
+        self.interval: float = interval
+        self.min_sleep: float = min_sleep
+
+        # amount of instructions executed between pacing checks (most instructions take 13 ticks)
+        self.batch: int = min(max(int(interval * speed / (13 * InstructionSet.tick_time)), 1), 65536)
+
+        # reference points; the sync one is moved after stalls, the start one is kept for the statistics
+        self._start_time: float = 0
+        self._start_ticks: int = 0
+        self._sync_time: float = 0
+        self._sync_ticks: int = 0
+
+    @staticmethod
+    def parse_speed(speed: str) -> float | None:
+        """
+        Parses speed strings like '1x', '10x', '0.5' or 'max'
+        :param speed: speed string
+        :return: speed multiplier, or None for 'max'
+        """
+
+        speed = speed.strip().lower()
+        if speed == "max":
+            return None
+        value = float(speed.removesuffix("x"))
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError("speed must be a positive number")
+        return value
+
+    def start(self, tick_counter: int):
+        """
+        Sets the reference point
+        :param tick_counter: current tick counter
+        """
+
+        self._start_time = self._sync_time = perf_counter()
+        self._start_ticks = self._sync_ticks = tick_counter
+
+    def sync(self, tick_counter: int):
+        """
+        Sleeps until the wall clock catches up with the emulated time.
+        Target time is always computed from the reference point, so the sleep
+        inaccuracies don't accumulate. When the emulator falls behind by more than
+        one interval (e.g. it waited for user input), the reference point is moved,
+        instead of running at full speed until it catches up.
+        :param tick_counter: current tick counter
+        """
+
+        now = perf_counter()
+        target = self._sync_time + (tick_counter - self._sync_ticks) * InstructionSet.tick_time / self.speed
+        delay = target - now
+        if delay >= self.min_sleep:
+            sleep(delay)
+        elif delay < -self.interval:
+            self._sync_time = now
+            self._sync_ticks = tick_counter
+
+    def emulated_time(self, tick_counter: int) -> float:
+        """
+        :param tick_counter: current tick counter
+        :return: emulated time since the reference point in seconds
+        """
+
+        return (tick_counter - self._start_ticks) * InstructionSet.tick_time
+
+    def achieved_speed(self, tick_counter: int) -> float:
+        """
+        :param tick_counter: current tick counter
+        :return: achieved speed multiplier since the reference point
+        """
+
+        elapsed = perf_counter() - self._start_time
+        if elapsed <= 0:
+            return 0
+        return self.emulated_time(tick_counter) / elapsed
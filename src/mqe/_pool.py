@@ -0,0 +1,51 @@
+from ._emulator import Emulator
+
+
+"""
+Pool of reusable emulators. Constructing an emulator allocates its memory, so servers
+hosting many short-lived programs can reset and reuse the released ones instead.
+"""
+
+
+class EmulatorPool:
+    """
+    Emulator allocator, which reuses released emulators.
+    """
+
+    def __init__(self, max_idle: int = 64, **kwargs):
+        """
+        :param max_idle: maximum amount of idle emulators kept in the pool
+        :param kwargs: keyword arguments passed to the new emulators
+        """
+
+        self.max_idle: int = max_idle
+        self._kwargs: dict = kwargs
+        self._idle: list[Emulator] = []
+
+    def __len__(self) -> int:
+        """
+        :return: amount of idle emulators
+        """
+
+        return len(self._idle)
+
+    def acquire(self) -> Emulator:
+        """
+        :return: emulator in the initial state
+        """
+
+        try:
+            return self._idle.pop()
+        except IndexError:
+            return Emulator(**self._kwargs)
+
+    def release(self, emulator: Emulator):
+        """
+        Resets the emulator and returns it into the pool
+        :param emulator: emulator, which was acquired from this pool
+        """
+
+        if len(self._idle) >= self.max_idle:
+            return
+        emulator.reset()
+        self._idle.append(emulator)
@@ -0,0 +1,618 @@
+import io
+import os
+import sys
+import json
+import queue
+import stat
+import errno
+import base64
+import signal
+import socket
+import hashlib
+import threading
+import socketserver
+import multiprocessing
+from time import perf_counter
+from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ._executable import Executable
+from ._pool import EmulatorPool
+
+
+"""
+Job server. Keeps a pool of warm worker processes, which run submitted executables.
+
+Protocol: newline delimited JSON over a local stream socket (Unix socket or localhost TCP).
+Several jobs can be submitted over one connection, and they run concurrently.
+
+Job (client -> server):
+  {"id": any, "rom": base64 executable | "path": executable path,
+   "input": str, "max_instructions": int, "max_ticks": int, "timeout": float}
+
+Messages (server -> client):
+  {"id": any, "output": str}                        - program output, streamed
+  {"id": any, "done": true, "status": str, "instructions": int, "ticks": int, "time": float}
+  status is one of "halted", "limit", "timeout", "cancelled", "rejected" (server is busy) or "error" (with "error")
+  empty lines are keepalives, which are sent while the jobs run; clients ignore them
+
+The server clamps the job limits to its own maximums, and the jobs of a client, which disconnects, are cancelled.
+
+Trust model: every local user, who can connect to the socket, can run jobs as the server user.
+The Unix socket is only accessible by its owner, while localhost TCP is open to all local users.
+Thus the jobs can't touch the server's files by default: executables with includes are rejected,
+unless the include is allowed (FileManager reads and writes any file), and "path" jobs are rejected,
+unless they are allowed (the server would open any path).
+"""
+
+
+# amount of ticks executed between limit checks
+_SLICE_TICKS: int = 13 * 1024
+
+# messages waiting to be written to a client; a client, which falls further behind, is disconnected
+_CONNECTION_QUEUE_SIZE: int = 1024
+
+# time given to a client to take the remaining messages, after its jobs have finished
+_CONNECTION_CLOSE_TIMEOUT: float = 10
+
+# time between keepalives, which find out when a client has gone
+_KEEPALIVE_INTERVAL: float = 1
+
+# worker process state
+_OUTPUT_QUEUE = None
+_EXECUTABLE_CACHE: dict[tuple, Executable] = {}
+_EXECUTABLE_CACHE_SIZE: int = 64
+_EMULATOR_POOL: EmulatorPool | None = None
+_ALLOWED_INCLUDES: frozenset[str] = frozenset()
+_CANCELLED = None
+
+
+class _OutputStream(io.TextIOBase):
+    """
+    Worker stdout, which sends the program output of a job to the server
+    """
+
+    def __init__(self, key: int, chunk_size: int = 4096):
+        self._key: int = key
+        self._chunk_size: int = chunk_size
+        self._buffer: list[str] = []
+        self._size: int = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not text:
+            return 0
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self._chunk_size or "\n" in text:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            _OUTPUT_QUEUE.put(("output", self._key, "".join(self._buffer)))
+            self._buffer.clear()
+            self._size = 0
+
+
+def _worker_init(output_queue, allowed_includes: frozenset[str], cancelled):
+    """
+    Worker process initializer
+    """
+
+    global _OUTPUT_QUEUE, _EMULATOR_POOL, _ALLOWED_INCLUDES, _CANCELLED
+
+    # the server handles Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _OUTPUT_QUEUE = output_queue
+    _EMULATOR_POOL = EmulatorPool(max_idle=1)
+    _ALLOWED_INCLUDES = allowed_includes
+    _CANCELLED = cancelled
+
+    # pre-import the allowed extensions
+    from .ext import load_extension, EXTENSIONS
+    for name in allowed_includes & EXTENSIONS.keys():
+        load_extension(EXTENSIONS[name])
+
+
+def _warm_up(_):
+    """
+    Empty job, which makes the pool start the worker processes
+    """
+
+    return os.getpid()
+
+
+def _load_executable(job: dict) -> Executable:
+    """
+    Decodes the job executable, or takes it from the cache
+    """
+
+    if "rom" in job:
+        data = base64.b64decode(job["rom"])
+        key = ("rom", hashlib.sha1(data).digest())
+    else:
+        stat = os.stat(job["path"])
+        key = ("path", job["path"], stat.st_mtime_ns, stat.st_size)
+        data = None
+
+    executable = _EXECUTABLE_CACHE.get(key)
+    if executable is None:
+        if data is None:
+            with open(job["path"], "rb") as file:
+                executable = Executable.read(file)
+        else:
+            executable = Executable.read(io.BytesIO(data))
+
+        # drop the oldest entry
+        if len(_EXECUTABLE_CACHE) >= _EXECUTABLE_CACHE_SIZE:
+            del _EXECUTABLE_CACHE[next(iter(_EXECUTABLE_CACHE))]
+        _EXECUTABLE_CACHE[key] = executable
+    return executable
+
+
+def _check_job(job: dict):
+    """
+    Checks the types of the job fields
+    :raises ValueError: when the job is invalid
+    """
+
+    if "rom" not in job and "path" not in job:
+        raise ValueError("job must have 'rom' or 'path'")
+    for name in ("rom", "path", "input"):
+        if not isinstance(job.get(name, ""), str):
+            raise ValueError(f"'{name}' must be a string")
+    for name in ("max_instructions", "max_ticks", "timeout"):
+        value = job.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ValueError(f"'{name}' must be a non-negative number")
+
+
+def _run_job(key: int, slot: int, job: dict):
+    """
+    Runs the job in a worker process. The output and the result are sent through the output queue.
+    The job stops, when the server sets the cancel flag of its slot
+    """
+
+    result = {"status": "halted", "instructions": 0, "ticks": 0}
+    stdout, stdin = sys.stdout, sys.stdin
+    emulator = _EMULATOR_POOL.acquire()
+    start = perf_counter()
+    try:
+        _check_job(job)
+        sys.stdout = _OutputStream(key)
+        sys.stdin = io.StringIO(job.get("input", ""))
+
+        executable = _load_executable(job)
+        denied = [include for include in executable.includes if include not in _ALLOWED_INCLUDES]
+        if denied:
+            raise PermissionError(f"includes not allowed on this server: {', '.join(denied)}")
+        emulator.load_executable(executable)
+
+        max_instructions = job.get("max_instructions")
+        max_ticks = job.get("max_ticks")
+        timeout = job.get("timeout")
+        while not _CANCELLED[slot] and emulator.execute_ticks(_SLICE_TICKS):
+            if max_instructions is not None and emulator.instruction_counter >= max_instructions:
+                result["status"] = "limit"
+                break
+            if max_ticks is not None and emulator.tick_counter >= max_ticks:
+                result["status"] = "limit"
+                break
+            if timeout is not None and perf_counter() - start >= timeout:
+                result["status"] = "timeout"
+                break
+        if _CANCELLED[slot]:
+            result["status"] = "cancelled"
+    except EOFError:
+        result.update(status="error", error="program input ended")
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.flush()
+        sys.stdout, sys.stdin = stdout, stdin
+
+    result.update(instructions=emulator.instruction_counter, ticks=emulator.tick_counter, time=perf_counter() - start)
+    _EMULATOR_POOL.release(emulator)
+    _OUTPUT_QUEUE.put(("done", key, result))
+
+
+class _Connection:
+    """
+    Client connection. The messages are queued, and written by the connection's own thread,
+    so a client, which doesn't read, can't stall the others; it is disconnected once its queue is full
+    """
+
+    def __init__(self, sock: socket.socket, file, on_disconnect=None):
+        """
+        :param sock: client socket
+        :param file: file writing to the socket
+        :param on_disconnect: function called with the connection, when the client is gone
+        """
+
+        self._socket = sock
+        self._file = file
+        self._on_disconnect = on_disconnect
+        self._queue: queue.Queue = queue.Queue(_CONNECTION_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._condition = threading.Condition(self._lock)
+        self.closed = False
+        self._writer = threading.Thread(target=self._write, name="mqe-connection", daemon=True)
+        self._writer.start()
+
+    def send(self, message: dict | None):
+        """
+        Queues the message (None sends a keepalive)
+        """
+
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(b"\n" if message is None else (json.dumps(message) + "\n").encode())
+        except queue.Full:
+            self.disconnect()
+
+    def _write(self):
+        """
+        Writer thread; writes the queued messages until it receives None
+        """
+
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            try:
+                self._file.write(data)
+                self._file.flush()
+            except OSError:
+                self.disconnect()
+                break
+
+    def disconnect(self):
+        """
+        Drops the client, without writing the queued messages
+        """
+
+        with self._lock:
+            was_closed, self.closed = self.closed, True
+        if not was_closed and self._on_disconnect is not None:
+            self._on_disconnect(self)
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Writes the queued messages, and stops the writer thread
+        """
+
+        if not self.closed:
+            try:
+                self._queue.put(None, timeout=_CONNECTION_CLOSE_TIMEOUT)
+                self._writer.join(_CONNECTION_CLOSE_TIMEOUT)
+            except queue.Full:
+                pass
+        if self._writer.is_alive():
+            self.disconnect()
+        self.closed = True
+
+    def job_started(self):
+        with self._lock:
+            self._pending += 1
+
+    def job_finished(self):
+        with self._lock:
+            self._pending -= 1
+            self._condition.notify_all()
+
+    def wait(self):
+        """
+        Waits for the jobs to finish; meanwhile sends keepalives, as a failed write is the only way
+        to find out, that a client, which closed its sending side already, is gone
+        """
+
+        with self._lock:
+            while self._pending > 0:
+                if not self._condition.wait(_KEEPALIVE_INTERVAL):
+                    self._lock.release()
+                    try:
+                        self.send(None)
+                    finally:
+                        self._lock.acquire()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = _Connection(self.request, self.wfile, on_disconnect=self.server.job_server.cancel)
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("job must be an object")
+                except ValueError as e:
+                    connection.send({"id": None, "done": True, "status": "error", "error": f"invalid job: {e}"})
+                    continue
+                try:
+                    _check_job(job)
+                except ValueError as e:
+                    connection.send({"id": job.get("id"), "done": True, "status": "error", "error": f"invalid job: {e}"})
+                    continue
+                self.server.job_server.submit(job, connection)
+        except OSError:
+            # the client was disconnected
+            pass
+        finally:
+            connection.wait()
+            connection.close()
+
+
+class JobServer:
+    """
+    Runs submitted jobs on a pool of warm worker processes.
+    """
+
+    def __init__(self, address: str | tuple[str, int], workers: int | None = None, queue_size: int = 64,
+                 allowed_includes: Iterable[str] = (), allow_paths: bool = False,
+                 max_job_seconds: float | None = 60, max_job_ticks: int | None = None):
+        """
+        :param address: Unix socket path (accessible only by the owner), or (host, port) tuple
+        :param workers: amount of worker processes (cpu count by default)
+        :param queue_size: amount of jobs waiting for a worker; jobs beyond it are rejected
+        :param allowed_includes: includes the executables may use; executables with other includes are rejected
+        :param allow_paths: allow "path" jobs, which make the server read the executable from its file system
+        :param max_job_seconds: maximum (and default) timeout of the jobs; None for no limit
+        :param max_job_ticks: maximum (and default) tick limit of the jobs; None for no limit
+        """
+
+        self.address: str | tuple[str, int] = address
+        self.workers: int = workers or os.cpu_count() or 1
+        self.allowed_includes: frozenset[str] = frozenset(allowed_includes)
+        self.allow_paths: bool = allow_paths
+        self.max_job_seconds: float | None = max_job_seconds
+        self.max_job_ticks: int | None = max_job_ticks
+
+        # jobs in progress or waiting; each one takes a slot, which has a cancel flag shared with the workers
+        self._free_slots: list[int] = list(range(self.workers + queue_size))
+        self._cancelled = multiprocessing.get_context().RawArray("b", self.workers + queue_size)
+        self._jobs: dict[int, tuple[object, _Connection, int]] = {}
+        self._jobs_lock: threading.Lock = threading.Lock()
+        self._next_key: int = 0
+
+        # worker pool; all the workers send output and results through one queue
+        self._output_queue = multiprocessing.get_context().Queue()
+        self._executor: ProcessPoolExecutor = self._new_executor()
+        self._executor_lock: threading.Lock = threading.Lock()
+        self._dispatcher: threading.Thread = threading.Thread(target=self._dispatch, name="mqe-dispatch", daemon=True)
+
+        # socket server
+        if isinstance(address, str):
+            # replace the socket left by a previous server, but nothing else
+            if os.path.lexists(address):
+                if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                    raise FileExistsError(errno.EEXIST, "file exists and is not a socket", address)
+                os.unlink(address)
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+        self._server: socketserver.BaseServer = server_class(address, _RequestHandler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.job_server = self
+
+        # the Unix socket is created accessible only by the owner
+        mask = os.umask(0o177) if isinstance(address, str) else None
+        try:
+            self._server.server_bind()
+            self._server.server_activate()
+        except BaseException:
+            self._server.server_close()
+            raise
+        finally:
+            if mask is not None:
+                os.umask(mask)
+
+    def submit(self, job: dict, connection: _Connection):
+        """
+        Queues the job, or rejects it when the queue is full
+        :param job: job
+        :param connection: connection the messages are sent to
+        """
+
+        if "rom" not in job and not self.allow_paths:
+            connection.send({"id": job.get("id"), "done": True, "status": "error",
+                             "error": "path jobs are not allowed on this server"})
+            return
+        with self._jobs_lock:
+            slot = self._free_slots.pop() if self._free_slots else None
+            if slot is not None:
+                self._cancelled[slot] = 0
+                key = self._next_key
+                self._next_key += 1
+                self._jobs[key] = (job.get("id"), connection, slot)
+        if slot is None:
+            connection.send({"id": job.get("id"), "done": True, "status": "rejected", "error": "server is busy"})
+            return
+        connection.job_started()
+
+        # server limits
+        job = dict(job)
+        for name, maximum in (("timeout", self.max_job_seconds), ("max_ticks", self.max_job_ticks)):
+            if maximum is not None:
+                job[name] = maximum if job.get(name) is None else min(job[name], maximum)
+
+        # a worker process may have died since the last job, which breaks the pool; the job is retried once
+        for retry in (True, False):
+            with self._executor_lock:
+                executor = self._executor
+            try:
+                future = executor.submit(_run_job, key, slot, job)
+                break
+            except BrokenProcessPool as e:
+                self._replace_executor(executor)
+                if not retry:
+                    self._job_failed(key, e)
+                    return
+            except Exception as e:
+                self._job_failed(key, e)
+                return
+        future.add_done_callback(lambda f: self._job_done(key, executor, f))
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, initializer=_worker_init,
+                                   initargs=(self._output_queue, self.allowed_includes, self._cancelled))
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        """
+        Replaces the broken worker pool, unless it was replaced already
+        """
+
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+        print("WARN: a worker process died, the worker pool was restarted", file=sys.stderr)
+
+    def _job_done(self, key: int, executor: ProcessPoolExecutor, future):
+        exception = future.exception()
+        if exception is None:
+            return
+        if isinstance(exception, BrokenProcessPool):
+            self._replace_executor(executor)
+        self._job_failed(key, exception)
+
+    def _finish(self, key: int, result: dict):
+        with self._jobs_lock:
+            entry = self._jobs.pop(key, None)
+            if entry is not None:
+                self._free_slots.append(entry[2])
+        if entry is None:
+            # the job failed already; the result came from a worker, which died afterwards
+            return
+        job_id, connection, _ = entry
+        connection.send({"id": job_id, "done": True, **result})
+        connection.job_finished()
+
+    def cancel(self, connection: _Connection):
+        """
+        Cancels the jobs of the connection; running jobs stop after their current slice
+        """
+
+        with self._jobs_lock:
+            for _, job_connection, slot in self._jobs.values():
+                if job_connection is connection:
+                    self._cancelled[slot] = 1
+
+    def _job_failed(self, key: int, exception: BaseException):
+        """
+        Worker process died, or the job could not be sent to it
+        """
+
+        self._finish(key, {"status": "error", "error": f"{type(exception).__name__}: {exception}"})
+
+    def _dispatch(self):
+        """
+        Routes the worker messages to the connections
+        """
+
+        while True:
+            kind, key, data = self._output_queue.get()
+            if kind == "output":
+                with self._jobs_lock:
+                    entry = self._jobs.get(key)
+                if entry is not None:
+                    job_id, connection, _ = entry
+                    connection.send({"id": job_id, "output": data})
+            else:
+                self._finish(key, data)
+
+    def serve_forever(self):
+        """
+        Starts the workers, and serves the requests until interrupted
+        """
+
+        # start the workers, so the first jobs don't wait for them
+        list(self._executor.map(_warm_up, range(self.workers)))
+
+        self._dispatcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            with self._executor_lock:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+class Client:
+    """
+    Job server client
+    """
+
+    def __init__(self, address: str | tuple[str, int]):
+        """
+        :param address: Unix socket path, or (host, port) tuple
+        """
+
+        self.address: str | tuple[str, int] = address
+
+    def run(self, jobs: list[dict], on_output=None) -> list[dict]:
+        """
+        Submits the jobs, which run concurrently, and waits for all of them
+        :param jobs: jobs (without ids; ids are assigned by their index)
+        :param on_output: function called with (job index, output) as the output is streamed
+        :return: results in the order of the jobs, each with the collected "output"
+        """
+
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        results = [{"output": ""} for _ in jobs]
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(self.address)
+            with sock.makefile("rwb") as file:
+                for index, job in enumerate(jobs):
+                    file.write((json.dumps({**job, "id": index}) + "\n").encode())
+                file.flush()
+                sock.shutdown(socket.SHUT_WR)
+
+                remaining = len(jobs)
+                for line in file:
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    index = message.pop("id")
+                    if index is None:
+                        raise ValueError(message.get("error"))
+                    if "output" in message:
+                        results[index]["output"] += message["output"]
+                        if on_output is not None:
+                            on_output(index, message["output"])
+                    if message.pop("done", False):
+                        results[index].update(message)
+                        remaining -= 1
+                        if remaining == 0:
+                            break
+        return results
+
+    @staticmethod
+    def job(path: str, send_rom: bool = True, **kwargs) -> dict:
+        """
+        Makes a job
+        :param path: executable path
+        :param send_rom: send the executable contents instead of the path
+        :param kwargs: other job fields (input, max_instructions, max_ticks, timeout)
+        :return: job
+        """
+
+        if send_rom:
+            with open(path, "rb") as file:
+                return {"rom": base64.b64encode(file.read()).decode(), **kwargs}
+        return {"path": os.path.abspath(path), **kwargs}
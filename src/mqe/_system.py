@@ -0,0 +1,204 @@
+import io
+import queue
+import multiprocessing
+from threading import BrokenBarrierError
+from multiprocessing import shared_memory
+from ._emulator import Emulator
+from ._pacing import Pacer
+
+
+"""
+Multi-CPU system. Several MQ CPUs, each with its own ROM, optionally sharing the ports
+and / or the cache. CPUs are interleaved in slices weighted by MQ ticks: every round
+moves the time horizon forward by a slice, and each CPU runs until its tick counter
+reaches the horizon, so the CPUs never drift apart by more than one slice.
+"""
+
+
+class System:
+    """
+    Hosts several emulators and schedules them.
+    """
+
+    def __init__(self, share_ports: bool = True, share_cache: bool = False, slice_ticks: int = 1300, **kwargs):
+        """
+        :param share_ports: all CPUs use the same ports
+        :param share_cache: all CPUs use the same cache
+        :param slice_ticks: length of one scheduling slice in ticks
+        :param kwargs: keyword arguments passed to each emulator
+        """
+
+        self.slice_ticks: int = slice_ticks
+        self.ports: bytearray | None = bytearray(256) if share_ports else None
+        self.cache: bytearray | None = bytearray(2**16) if share_cache else None
+        self.cpus: list[Emulator] = []
+
+        self._kwargs: dict = kwargs
+        self._roms: list[bytes] = []
+
+    def add(self, data: bytes) -> Emulator:
+        """
+        Adds a CPU to the system
+        :param data: contents of the executable file
+        :return: the CPU emulator
+        """
+
+        emulator = Emulator(ports=self.ports, cache=self.cache, **self._kwargs)
+        emulator.load_binary_file(io.BytesIO(data))
+        self.cpus.append(emulator)
+        self._roms.append(data)
+        return emulator
+
+    @property
+    def tick_counter(self) -> int:
+        """
+        :return: time of the system (the slowest CPU) in ticks
+        """
+
+        return min((cpu.tick_counter for cpu in self.cpus), default=0)
+
+    def run(self, pacer: Pacer | None = None):
+        """
+        Runs all the CPUs in the same process, until all of them stop
+        :param pacer: when given, the execution is paced after each round;
+                      the slices are shortened to the pacer batch, so the rounds are short enough to pace
+        :raises RuntimeError: when a CPU failed; the other CPUs are stopped
+        """
+
+        running = list(self.cpus)
+        horizon = self.tick_counter
+        slice_ticks = self.slice_ticks
+        if pacer is not None:
+            slice_ticks = min(slice_ticks, pacer.batch * 13)
+            pacer.start(horizon)
+        try:
+            while running:
+                horizon += slice_ticks
+                for cpu in list(running):
+                    try:
+                        if cpu.tick_counter < horizon and not cpu.execute_ticks(horizon - cpu.tick_counter):
+                            running.remove(cpu)
+                    except Exception as e:
+                        raise RuntimeError(f"CPU {self.cpus.index(cpu)}: {type(e).__name__}: {e}") from e
+                if pacer is not None:
+                    pacer.sync(horizon)
+        except KeyboardInterrupt:
+            print("INFO: system was interrupted by the user", end="")
+
+    def run_processes(self):
+        """
+        Runs each CPU in its own process. Shared ports and cache are placed into shared memory,
+        and the processes are kept in step by a barrier after each slice.
+        When a CPU fails, the barrier is aborted, which stops the other CPUs.
+        :raises RuntimeError: when a CPU failed
+        """
+
+        ctx = multiprocessing.get_context()
+        count = len(self.cpus)
+        barrier = ctx.Barrier(count)
+        running = ctx.Value("i", count)
+        results = ctx.Queue()
+
+        # shared memory blocks
+        shared = {}
+        for name, buffer in (("ports", self.ports), ("cache", self.cache)):
+            if buffer is not None:
+                shared[name] = shared_memory.SharedMemory(create=True, size=len(buffer))
+                shared[name].buf[:] = buffer
+
+        try:
+            processes = [
+                ctx.Process(
+                    target=_cpu_process,
+                    args=(index, rom, self._kwargs, {name: shm.name for name, shm in shared.items()},
+                          self.slice_ticks, barrier, running, results),
+                    name=f"mqe-cpu-{index}")
+                for index, rom in enumerate(self._roms)
+            ]
+            for process in processes:
+                process.start()
+
+            # collect the counters; a process, which died without reporting, would keep the others waiting
+            errors = []
+            pending = set(range(count))
+            while pending:
+                try:
+                    index, instruction_counter, tick_counter, error = results.get(timeout=0.1)
+                except queue.Empty:
+                    for index in sorted(pending):
+                        exitcode = processes[index].exitcode
+                        if exitcode is not None and exitcode != 0:
+                            pending.remove(index)
+                            errors.append(f"CPU {index} exited with code {exitcode}")
+                            barrier.abort()
+                    continue
+                if index not in pending:
+                    continue
+                pending.remove(index)
+                if instruction_counter is not None:
+                    self.cpus[index].instruction_counter = instruction_counter
+                    self.cpus[index].tick_counter = tick_counter
+                if error is not None:
+                    errors.append(f"CPU {index}: {error}")
+            for process in processes:
+                process.join()
+
+            # copy the shared memory back
+            if "ports" in shared:
+                self.ports[:] = shared["ports"].buf
+            if "cache" in shared:
+                self.cache[:] = shared["cache"].buf
+            if errors:
+                raise RuntimeError(", ".join(errors))
+        finally:
+            for shm in shared.values():
+                shm.close()
+                shm.unlink()
+
+
+def _cpu_process(index, rom, kwargs, shared_names, slice_ticks, barrier, running, results):
+    """
+    Process body of System.run_processes
+    """
+
+    shared = {name: shared_memory.SharedMemory(name=shm_name) for name, shm_name in shared_names.items()}
+    emulator = None
+    error = None
+    try:
+        try:
+            emulator = Emulator(**{name: shm.buf for name, shm in shared.items()}, **kwargs)
+            emulator.load_binary_file(io.BytesIO(rom))
+
+            is_running = True
+            horizon = 0
+            while True:
+                # run the slice
+                horizon += slice_ticks
+                if is_running and emulator.tick_counter < horizon:
+                    is_running = emulator.execute_ticks(horizon - emulator.tick_counter)
+                    if not is_running:
+                        with running.get_lock():
+                            running.value -= 1
+                barrier.wait()
+
+                # the counter only changes before the first barrier, so every process sees the same value
+                done = running.value == 0
+                barrier.wait()
+                if done:
+                    break
+        except BrokenBarrierError:
+            # another CPU failed
+            pass
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            barrier.abort()
+
+        # always report, so the parent doesn't wait for this process
+        if emulator is None:
+            results.put((index, None, None, error))
+        else:
+            results.put((index, emulator.instruction_counter, emulator.tick_counter, error))
+        del emulator
+    finally:
+        for shm in shared.values():
+            shm.close()
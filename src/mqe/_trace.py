@@ -0,0 +1,191 @@
+import queue
+import struct
+import threading
+from typing import BinaryIO, Iterator
+from ._mqis import *
+
+
+"""
+Compact binary execution trace.
+
+File layout:
+  header : 4 bytes - magic "MQT1"
+  records: N * 8 bytes, one per executed instruction
+
+Record layout (little endian):
+  pc     : 2 bytes - program counter of the executed instruction
+  opcode : 1 byte  - opcode, with bit 7 set if the memory flag was on
+  operand: 1 byte  - operand (data field of the instruction)
+  bus    : 1 byte  - value on the rom/cache bus (operand or cache value)
+  acc    : 1 byte  - accumulator after the instruction
+  carry  : 1 byte  - carry flag after the instruction
+  ticks  : 1 byte  - amount of ticks the instruction took
+"""
+
+
+TRACE_MAGIC = b"MQT1"
+TRACE_RECORD = struct.Struct("<HBBBBBB")
+
+
+class TraceWriter:
+    """
+    Writes trace records to a file. Records are packed into chunks on the emulator side,
+    and the chunks are handed to a background thread through a bounded queue, so the
+    disk I/O (and compression) does not block the emulation.
+    """
+
+    def __init__(self, path: str, compress: bool = False, chunk_records: int = 16384, queue_size: int = 64):
+        """
+        :param path: output file path
+        :param compress: compress the trace with gzip
+        :param chunk_records: amount of records packed before handing the chunk to the writer thread
+        :param queue_size: maximum amount of chunks waiting to be written
+        """
+
+        self.path: str = path
+        self.compress: bool = compress
+
+        # chunk that is currently being filled
+        self._chunk_size: int = chunk_records * TRACE_RECORD.size
+        self._chunk: bytearray = bytearray(self._chunk_size)
+        self._offset: int = 0
+
+        # writer thread
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.error: Exception | None = None             # write error of the writer thread
+        if compress:
+            import gzip
+            self._file: BinaryIO = gzip.open(path, "wb", compresslevel=6)
+        else:
+            self._file: BinaryIO = open(path, "wb")
+        self._file.write(TRACE_MAGIC)
+        self._thread: threading.Thread = threading.Thread(target=self._writer, name="mqe-trace", daemon=True)
+        self._thread.start()
+
+    def _writer(self):
+        """
+        Background thread; writes the chunks until it receives None.
+        A write error is stored, and raised by the next flush or close
+        """
+
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                self._file.write(chunk)
+            self._file.close()
+        except Exception as e:
+            self.error = e
+
+            # keep taking the chunks, so flush doesn't block on a full queue
+            while self._queue.get() is not None:
+                pass
+            try:
+                self._file.close()
+            except Exception:
+                pass
+
+    def record(self, pc: int, opcode: int, operand: int, bus: int, acc: int, carry: bool, ticks: int):
+        """
+        Appends a record to the trace
+        """
+
+        TRACE_RECORD.pack_into(self._chunk, self._offset, pc, opcode, operand, bus, acc, carry, ticks)
+        self._offset += TRACE_RECORD.size
+        if self._offset == self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the current chunk to the writer thread
+        :raises OSError: when the writer thread failed to write the trace
+        """
+
+        if self.error is not None:
+            raise self.error
+        if self._offset == 0:
+            return
+
+        # blocks when the writer thread is behind, which keeps the memory bounded
+        self._queue.put(bytes(self._chunk[:self._offset]))
+        self._offset = 0
+
+    def close(self):
+        """
+        Flushes the remaining records and waits for the writer thread to finish
+        :raises OSError: when the writer thread failed to write the trace
+        """
+
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class TraceReader:
+    """
+    Reads trace files written by TraceWriter (compressed or not)
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def _open(self) -> BinaryIO:
+        with open(self.path, "rb") as file:
+            is_gzip = file.read(2) == b"\x1f\x8b"
+        if is_gzip:
+            import gzip
+            file = gzip.open(self.path, "rb")
+        else:
+            file = open(self.path, "rb")
+        if file.read(4) != TRACE_MAGIC:
+            file.close()
+            raise ValueError(f"'{self.path}' is not a trace file")
+        return file
+
+    def __iter__(self) -> Iterator[tuple[int, int, int, int, int, int, int]]:
+        """
+        Iterates over the records (pc, opcode, operand, bus, acc, carry, ticks)
+        """
+
+        with self._open() as file:
+            while True:
+                data = file.read(TRACE_RECORD.size * 16384)
+                if not data:
+                    break
+                yield from TRACE_RECORD.iter_unpack(data[:len(data) - len(data) % TRACE_RECORD.size])
+
+    def dump(self):
+        """
+        Prints the trace as text
+        """
+
+        for pc, opcode, operand, bus, acc, carry, ticks in self:
+            mnemonic = InstructionSet.instruction_set.get(opcode & 127, {"name": "???"})["name"]
+            arg = f"${operand}" if opcode >> 7 else f"{operand}"
+            print(f"{pc:0>5}  {mnemonic: <4} {arg: <4}  bus={bus: <3} acc={acc: <3} carry={carry} ticks={ticks}")
+
+    def stats(self):
+        """
+        Prints the trace statistics
+        """
+
+        instructions = 0
+        ticks = 0
+        opcodes = {}
+        for record in self:
+            instructions += 1
+            ticks += record[6]
+            opcode = record[1] & 127
+            opcodes[opcode] = opcodes.get(opcode, 0) + 1
+
+        print(f"Instructions   : {instructions}")
+        print(f"Time in ticks  : {ticks} ticks")
+        print("Instruction counts:")
+        for opcode, count in sorted(opcodes.items(), key=lambda x: x[1], reverse=True):
+            mnemonic = InstructionSet.instruction_set.get(opcode, {"name": "???"})["name"]
+            print(f"\t{mnemonic: <4} {count: >12} ({count / instructions * 100:.2f}%)")
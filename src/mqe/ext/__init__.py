@@ -1,2 +1,34 @@
-from ._file_system import FileManager
-from ._display import DisplayManager
+import importlib
+
+
+"""
+Extensions are imported lazily (on attribute access), as the display manager imports tkinter.
+"""
+
+
+EXTENSIONS: dict[str, str] = {
+    "FileManager": "mqe.ext._file_system:FileManager",
+    "DisplayManager": "mqe.ext._display:DisplayManager",
+}
+
+__all__ = list(EXTENSIONS)
+
+
+def load_extension(spec: str):
+    """
+    Imports the extension
+    :param spec: extension in 'module:attribute' form
+    :return: extension class
+    """
+
+    module_name, _, attribute = spec.partition(":")
+    extension = importlib.import_module(module_name)
+    for name in filter(None, attribute.split(".")):
+        extension = getattr(extension, name)
+    return extension
+
+
+def __getattr__(name: str):
+    if name in EXTENSIONS:
+        return load_extension(EXTENSIONS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
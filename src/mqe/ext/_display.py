@@ -1,3 +1,4 @@
+from time import perf_counter
 from tkinter import Tk, Canvas, PhotoImage
 
 
@@ -42,6 +43,9 @@ class DisplayManager:
     2 for page mode
     """
 
+    # handled interrupt operations
+    INTERRUPTS: tuple[int, ...] = (1, 2)
+
     # display manager parameters
     INITIALIZED: bool = False
 
@@ -57,6 +61,10 @@ class DisplayManager:
     UPDATE_RATE: float = 1 / 30
     PREV_VALUE: float = 0
 
+    # window updates done, and missed because the emulator didn't call update in time
+    FRAMES_DRAWN: int = 0
+    FRAMES_DROPPED: int = 0
+
     @classmethod
     def initialize(cls, mode: int):
         """
@@ -86,10 +94,6 @@ class DisplayManager:
         :param emu: emulator
         """
 
-        # check interrupt operations
-        if emu.ports[0] != 1 and emu.ports[0] != 2:
-            return
-
         # check initialization
         if not cls.INITIALIZED:
             # width and height
@@ -121,6 +125,20 @@ class DisplayManager:
         elif emu.ports[0] == 2:
             cls.page_update(emu.cache)
 
+    @classmethod
+    def update(cls):
+        """
+        Updates the window, if enough time has passed since the last update
+        """
+
+        if cls.ROOT is not None and perf_counter() - cls.PREV_VALUE > cls.UPDATE_RATE:
+            now = perf_counter()
+            if cls.FRAMES_DRAWN > 0:
+                cls.FRAMES_DROPPED += max(int((now - cls.PREV_VALUE) / cls.UPDATE_RATE) - 1, 0)
+            cls.FRAMES_DRAWN += 1
+            cls.PREV_VALUE = now
+            cls.ROOT.update()
+
     @classmethod
     def plot(cls, x, y, val):
         # get RGB values, and put them in a range 0 - 255
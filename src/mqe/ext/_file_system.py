@@ -18,6 +18,13 @@ class FileManager:
     The file manager class, uses interrupt operation 0.
     """
 
+    # handled interrupt operations
+    INTERRUPTS: tuple[int, ...] = (0,)
+
+    # bytes moved between files and cache
+    BYTES_READ: int = 0
+    BYTES_WRITTEN: int = 0
+
     @classmethod
     def process(cls, emu: EmulatorStub):
         """
@@ -25,10 +32,6 @@ class FileManager:
         :param emu: emulator
         """
 
-        # check interrupt operations
-        if emu.ports[0] != 0:
-            return
-
         # operation - port 1
         # ptr_low, ptr_high - 2, 3
         # size_low, size_high - 4, 5
@@ -82,6 +85,7 @@ class FileManager:
                 # write into cache
                 emu.cache[ptr + offset] = value[0]
                 offset += 1
+                FileManager.BYTES_READ += 1
 
     @staticmethod
     def write_file(emu, ptr: int, size: int):
@@ -109,3 +113,4 @@ class FileManager:
 
                 # write into file
                 file.write(bytes([emu.cache[ptr + i]]))
+                FileManager.BYTES_WRITTEN += 1